@@ -60,6 +60,7 @@ class Defaults(metaclass=DefaultsMeta):
     CONFIG_FILE_PATH = pe.settings.config_file_path  # The GUI handles the path for this
     SYNC_FILE_PATH = os.path.join(SCRIPT_DIR, 'sync')
     THUMB_FILE_PATH = os.path.join(SCRIPT_DIR, 'thumbnails')
+    PARSE_CACHE_PATH = os.path.join(SCRIPT_DIR, 'parse_cache')
     LOG_FILE = os.path.join(SCRIPT_DIR, 'moss.log')
 
     CONTENT_DIR = os.path.join(SCRIPT_DIR, 'content')
@@ -112,6 +113,7 @@ class Defaults(metaclass=DefaultsMeta):
     BUTTON_DISABLED_LIGHT_COLOR = (*BACKGROUND, 150)
 
     PREVIEW_SIZE = (312, 416)
+    FRAME_CACHE_BYTES = 256 * 1024 * 1024  # Rendered notebook frames kept in memory
 
     # Colors
     OUTLINE_COLOR = pe.colors.black
@@ -1,6 +1,7 @@
 import json
 import os
 import shutil
+from concurrent.futures.process import BrokenProcessPool
 from functools import lru_cache
 from traceback import print_exc
 from typing import TYPE_CHECKING, Tuple
@@ -13,7 +14,7 @@ import rm_api.models as models
 from gui.defaults import Defaults
 from gui.pp_helpers.context_menu import ContextMenu
 from rm_api.storage.v3 import get_file_contents, get_file, make_files_request
-from rm_lines import rm_bytes_to_svg
+from rm_lines.parallel import get_shared_pool, render_page
 
 if TYPE_CHECKING:
     from rm_api.models import Document
@@ -156,17 +157,30 @@ class DocumentDebugPopup(ContextMenu):
             print_exc()
             pass
 
-        for file in files:
-            data: bytes = get_file_contents(self.api, file.hash, binary=True, use_cache=False)
-            file_path = os.path.join(location, f'{i:>03} {self.clean_file_uuid(file)}.svg')
+        pages = [get_file_contents(self.api, file.hash, binary=True, use_cache=False) for file in files]
 
-            # Render and save
-            try:
-                svg: str = rm_bytes_to_svg(data)
-                with open(file_path, 'w') as f:
-                    f.write(svg)
-            except Exception as e:
-                print_exc()
+        # Render all pages in parallel and save
+        blob_hashes = [file.hash for file in files]
+        try:
+            rendered_pages = get_shared_pool().render_pages(
+                pages, blob_hashes=blob_hashes, cache_dir=Defaults.PARSE_CACHE_PATH
+            )
+        except (BrokenProcessPool, OSError):
+            # Worker processes are unavailable, render here instead
+            rendered_pages = [
+                render_page(page, blob_hash=blob_hash, cache_dir=Defaults.PARSE_CACHE_PATH)
+                for page, blob_hash in zip(pages, blob_hashes)
+            ]
+        for file, rendered in zip(files, rendered_pages):
+            file_path = os.path.join(location, f'{i:>03} {self.clean_file_uuid(file)}.svg')
+            if rendered.error:
+                print(f"{Fore.RED}Could not render file with UUID={file.uuid}: {rendered.error}{Fore.RESET}")
+            else:
+                try:
+                    with open(file_path, 'w') as f:
+                        f.write(rendered.svg)
+                except Exception as e:
+                    print_exc()
             i += 1
 
     def render_important(self):
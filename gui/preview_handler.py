@@ -150,7 +150,8 @@ class PreviewHandler:
             if not rm_bytes:
                 raise Exception('Page content unavailable to construct preview')
             image = Notebook_rM_Lines_Renderer.generate_expanded_notebook_from_rm(document.metadata, rm_bytes,
-                                                                                  use_lock=cls.PYGAME_THREAD_LOCK).get_frame_from_initial(
+                                                                                  use_lock=cls.PYGAME_THREAD_LOCK,
+                                                                                  file_hash=file_hash).get_frame_from_initial(
                 0, 0)
             image.resize(Defaults.PREVIEW_SIZE)
         else:
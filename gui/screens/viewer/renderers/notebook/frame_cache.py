@@ -0,0 +1,82 @@
+import itertools
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, Optional, Set, Tuple
+
+
+@dataclass
+class FrameCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    evicted_bytes: int = 0
+    released_bytes: int = 0
+
+
+class FrameCache:
+    """
+    Rendered frames of all open notebooks, dropping the least recently used
+    once they take more than `max_bytes`
+
+    Each notebook registers as an owner, and releases its frames when it closes
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.stats = FrameCacheStats()
+        # (owner, key): (frame, size in bytes), least recently used first
+        self._frames: 'OrderedDict[Tuple[int, Hashable], Tuple[Any, int]]' = OrderedDict()
+        self._owners: Set[int] = set()
+        self._owner_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def register(self) -> int:
+        with self._lock:
+            owner = next(self._owner_ids)
+            self._owners.add(owner)
+            return owner
+
+    def get(self, owner: int, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._frames.get((owner, key))
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            self._frames.move_to_end((owner, key))
+            self.stats.hits += 1
+            return entry[0]
+
+    def put(self, owner: int, key: Hashable, frame: Any, size_bytes: int):
+        with self._lock:
+            # Released owners may still be finishing a frame in another thread
+            if owner not in self._owners or size_bytes > self.max_bytes:
+                return
+            previous = self._frames.pop((owner, key), None)
+            if previous is not None:
+                self.size_bytes -= previous[1]
+            self._frames[(owner, key)] = (frame, size_bytes)
+            self.size_bytes += size_bytes
+            while self.size_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._frames.popitem(last=False)
+                self.size_bytes -= evicted_bytes
+                self.stats.evictions += 1
+                self.stats.evicted_bytes += evicted_bytes
+
+    def release(self, owner: int):
+        """Drop all frames of `owner`, which can't add frames afterwards"""
+        with self._lock:
+            self._owners.discard(owner)
+            for frame_key in [frame_key for frame_key in self._frames if frame_key[0] == owner]:
+                _, size_bytes = self._frames.pop(frame_key)
+                self.size_bytes -= size_bytes
+                self.stats.released_bytes += size_bytes
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.size_bytes = 0
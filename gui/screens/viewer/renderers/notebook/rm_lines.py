@@ -1,62 +1,124 @@
-from functools import lru_cache
 import threading
 import re
+import weakref
+from abc import abstractmethod
 from io import BytesIO
+from concurrent.futures.process import BrokenProcessPool
 from traceback import print_exc
-from typing import Dict, Tuple, Union
+from typing import Dict, List, Tuple, Union
 
 import pygameextra as pe
+from gui.defaults import Defaults
 from gui.screens.viewer.renderers.notebook.expanded_notebook import ExpandedNotebook
+from gui.screens.viewer.renderers.notebook.frame_cache import FrameCache
 from gui.screens.viewer.renderers.shared_model import AbstractRenderer
 from rm_api.models import Metadata
-from rm_lines import rm_bytes_to_svg
+from rm_lines import read_tree, rm_bytes_to_svg
+from rm_lines.inker import RasterScene
 from rm_lines.inker.document_size_tracker import NotebookSizeTracker, PDFSizeTracker
+from rm_lines.inker.raster import PygameCanvas
+from rm_lines.parallel import get_shared_pool
+from rm_lines.parse_cache import get_parse_cache
 
 
-class rM_Lines_ExpandedNotebook(ExpandedNotebook):
-    WIDTH_PATTERN = r'width="([\d.]+)"'
-    HEIGHT_PATTERN = r'height="([\d.]+)"'
-    VIEWPORT_PATTERN = r'viewBox="([\d.-]+) ([\d.-]+) ([\d.]+) ([\d.]+)"'
+# Frames of all notebooks, see `rM_Lines_CachedNotebook`
+FRAME_CACHE = FrameCache(Defaults.FRAME_CACHE_BYTES)
+
+
+class rM_Lines_CachedNotebook(ExpandedNotebook):
+    """
+    Keeps rendered frames in the shared FRAME_CACHE until the notebook is released
+    or garbage collected
+    """
+
+    def __init__(self, frame_width: int, frame_height: int, track_xy: NotebookSizeTracker):
+        super().__init__(frame_width, frame_height, track_xy)
+        self.cache_owner = FRAME_CACHE.register()
+        # The finalizer must not refer to the notebook, or it would never be collected
+        self._finalizer = weakref.finalize(self, FRAME_CACHE.release, self.cache_owner)
+
+    @property
+    @abstractmethod
+    def default_size(self) -> Tuple[int, int]:
+        ...
+
+    @abstractmethod
+    def render_frame(self, frame_x, frame_y, final_width: int, final_height: int) -> pe.Image:
+        ...
+
+    def get_frame_from_initial(self, frame_x, frame_y, final_width: int = None, final_height: int = None) -> pe.Image:
+        default_width, default_height = self.default_size
+        if final_width is None:
+            final_width = default_width
+        if final_height is None:
+            final_height = default_height
+
+        key = (frame_x, frame_y, (final_width, final_height))
+        frame = FRAME_CACHE.get(self.cache_owner, key)
+        if frame is None:
+            frame = self.render_frame(frame_x, frame_y, final_width, final_height)
+            # Frames are 32-bit surfaces
+            FRAME_CACHE.put(self.cache_owner, key, frame, final_width * final_height * 4)
+        return frame
+
+    def release(self):
+        self._finalizer()
+
+
+class rM_Lines_ExpandedNotebook(rM_Lines_CachedNotebook):
+    WIDTH_PATTERN = re.compile(r'width="([\d.]+)"')
+    HEIGHT_PATTERN = re.compile(r'height="([\d.]+)"')
+    VIEWPORT_PATTERN = re.compile(r'viewBox="([\d.-]+) ([\d.-]+) ([\d.]+) ([\d.]+)"')
 
     def __init__(self, svg: str, frame_width: int, frame_height: int, track_xy: NotebookSizeTracker,
                  use_lock: threading.Lock = None):
         super().__init__(frame_width, frame_height, track_xy)
-        self.svg = svg
         self.use_lock = use_lock
+        self.width, self.height, self.template = self.parse_template(svg)
 
-    @lru_cache()
-    def get_frame_from_initial(self, frame_x, frame_y, final_width: int = None, final_height: int = None) -> pe.Image:
-        # Replace the svg viewport with a viewport to capture the frame
+    @classmethod
+    def parse_template(cls, svg: str) -> Tuple[float, float, List[Union[bytes, str]]]:
+        """
+        Split the svg around the width, height and viewBox of the svg element,
+        the template holds the encoded svg with the names of those attributes in between
+        """
+        svg_end = svg.index('>', svg.index('<svg'))
+        attributes = []
+        for name, pattern in (('width', cls.WIDTH_PATTERN), ('height', cls.HEIGHT_PATTERN),
+                              ('viewBox', cls.VIEWPORT_PATTERN)):
+            if not (match := pattern.search(svg, 0, svg_end)):
+                raise ValueError(f'No {name} in the svg element')
+            attributes.append((match, name))
+        width = float(attributes[0][0].group(1))
+        height = float(attributes[1][0].group(1))
 
-        # TODO: move these to __init__ or property setter of svg
-        width_match = re.search(self.WIDTH_PATTERN, self.svg)
-        height_match = re.search(self.HEIGHT_PATTERN, self.svg)
-        viewbox_match = re.search(self.VIEWPORT_PATTERN, self.svg)
+        template = []
+        position = 0
+        for match, name in sorted(attributes, key=lambda attribute: attribute[0].start()):
+            template.append(svg[position:match.start()].encode())
+            template.append(name)
+            position = match.end()
+        template.append(svg[position:].encode())
+        return width, height, template
 
-        width = float(width_match.group(1))
-        height = float(height_match.group(1))
-        x = float(viewbox_match.group(1))
-        y = float(viewbox_match.group(2))
-        w = float(viewbox_match.group(3))
-        h = float(viewbox_match.group(4))
+    @property
+    def default_size(self) -> Tuple[int, int]:
+        return int(self.width), int(self.height)
 
-        if final_width is None:
-            final_width = int(width)
-        if final_height is None:
-            final_height = int(height)
-
-        # Replace values in the SVG content
-        svg_content = re.sub(self.WIDTH_PATTERN, f'width="{final_width}"', self.svg)
-        svg_content = re.sub(self.HEIGHT_PATTERN, f'height="{final_height}"', svg_content)
-        svg_content = re.sub(self.VIEWPORT_PATTERN,
-                             f'viewBox="'
-                             f'{frame_x * self.frame_width - self.track_xy.offset_x} '
-                             f'{frame_y * self.frame_height - self.track_xy.offset_y} '
-                             f'{self.frame_width} '
-                             f'{self.frame_height}"',
-                             svg_content)
-
-        encoded_svg_content = svg_content.encode()
+    def render_frame(self, frame_x, frame_y, final_width: int, final_height: int) -> pe.Image:
+        # Replace the svg viewport with a viewport to capture the frame
+        attributes = {
+            'width': f'width="{final_width}"'.encode(),
+            'height': f'height="{final_height}"'.encode(),
+            'viewBox': (
+                f'viewBox="'
+                f'{frame_x * self.frame_width - self.track_xy.offset_x} '
+                f'{frame_y * self.frame_height - self.track_xy.offset_y} '
+                f'{self.frame_width} '
+                f'{self.frame_height}"'
+            ).encode(),
+        }
+        encoded_svg_content = b''.join(attributes.get(part, part) for part in self.template)
         # if self.use_lock:
         #     with self.use_lock:
         #         return pe.Image(BytesIO(encoded_svg_content), (final_width, final_height))
@@ -64,6 +126,33 @@ class rM_Lines_ExpandedNotebook(ExpandedNotebook):
         return pe.Image(BytesIO(encoded_svg_content), (final_width, final_height))
 
 
+class rM_Lines_RasterExpandedNotebook(rM_Lines_CachedNotebook):
+    """
+    Draws frames straight from the strokes of the page, without going through SVG
+    """
+
+    def __init__(self, scene: RasterScene, frame_width: int, frame_height: int, track_xy: NotebookSizeTracker):
+        super().__init__(frame_width, frame_height, track_xy)
+        self.scene = scene
+
+    @property
+    def default_size(self) -> Tuple[int, int]:
+        return int(self.track_xy.track_width), int(self.track_xy.track_height)
+
+    def render_frame(self, frame_x, frame_y, final_width: int, final_height: int) -> pe.Image:
+        canvas = self.scene.render(
+            (
+                frame_x * self.frame_width - self.track_xy.offset_x,
+                frame_y * self.frame_height - self.track_xy.offset_y,
+                self.frame_width,
+                self.frame_height
+            ),
+            (final_width, final_height),
+            PygameCanvas
+        )
+        return pe.Image(pe.Surface(surface=canvas.surface))
+
+
 # noinspection PyPep8Naming
 class Notebook_rM_Lines_Renderer(AbstractRenderer):
     """
@@ -73,8 +162,10 @@ class Notebook_rM_Lines_Renderer(AbstractRenderer):
     This renderer is also used for debug rendering and previews
     """
 
-    pages: Dict[str, Union[rM_Lines_ExpandedNotebook, None]]
+    pages: Dict[str, Union[ExpandedNotebook, None]]
     RENDER_ERROR = 'Error rendering writing for this page'
+    # Smaller SVGs for pygame to parse, precise to a hundredth of a pixel
+    SVG_OPTIONS = {"compact_paths": True, "precision": 2, "comments": False}
 
     def __init__(self, document_renderer):
         super().__init__(document_renderer)
@@ -82,8 +173,9 @@ class Notebook_rM_Lines_Renderer(AbstractRenderer):
 
     def _load(self, page_uuid: str):
         if content := self.document.content_data.get(file_uuid := f'{self.document.uuid}/{page_uuid}.rm'):
+            file_hash = next((file.hash for file in self.document.files if file.uuid == file_uuid), None)
             self.pages[file_uuid] = self.generate_expanded_notebook_from_rm(self.document.metadata, content,
-                                                                            size=self.size)
+                                                                            size=self.size, file_hash=file_hash)
         self.document_renderer.loading -= 1
 
     def load(self):
@@ -116,13 +208,29 @@ class Notebook_rM_Lines_Renderer(AbstractRenderer):
 
     @staticmethod
     def generate_expanded_notebook_from_rm(metadata: Metadata, content: bytes, size: Tuple[int, int] = None,
-                                           use_lock: threading.Lock = None) -> rM_Lines_ExpandedNotebook:
+                                           use_lock: threading.Lock = None,
+                                           file_hash: str = None) -> ExpandedNotebook:
         try:
             if metadata.type == 'DocumentType':
                 track_xy = NotebookSizeTracker()
             else:
                 track_xy = PDFSizeTracker()
-            svg: str = rm_bytes_to_svg(content, track_xy)
+            if pe.settings.config.notebook_render_mode == 'rm_lines_raster_inker':
+                expanded = Notebook_rM_Lines_Renderer.generate_raster_notebook(content, track_xy, file_hash)
+                expanded.get_frame_from_initial(0, 0, *(size if size else ()))
+                return expanded
+            try:
+                # Parse in a worker process so pages load on all cores
+                rendered = get_shared_pool().submit_render(
+                    content, track_xy, file_hash, Defaults.PARSE_CACHE_PATH,
+                    Notebook_rM_Lines_Renderer.SVG_OPTIONS
+                ).result()
+            except (BrokenProcessPool, OSError):
+                svg: str = rm_bytes_to_svg(content, track_xy, Notebook_rM_Lines_Renderer.SVG_OPTIONS)
+            else:
+                if rendered.error:
+                    raise Exception(rendered.error)
+                svg, track_xy = rendered.svg, rendered.track_xy
             expanded = rM_Lines_ExpandedNotebook(svg, track_xy.frame_width, track_xy.frame_height, track_xy, use_lock)
             expanded.get_frame_from_initial(0, 0, *(size if size else ()))
         except Exception as e:
@@ -131,5 +239,22 @@ class Notebook_rM_Lines_Renderer(AbstractRenderer):
         else:
             return expanded
 
+    @staticmethod
+    def generate_raster_notebook(content: bytes, track_xy: NotebookSizeTracker,
+                                 file_hash: str = None) -> rM_Lines_RasterExpandedNotebook:
+        if file_hash:
+            tree = get_parse_cache(Defaults.PARSE_CACHE_PATH).read_tree(content, file_hash)
+        else:
+            tree = read_tree(content, {"compact_points": True})
+        scene = RasterScene.from_tree(tree, track_xy)
+        return rM_Lines_RasterExpandedNotebook(scene, track_xy.frame_width, track_xy.frame_height, track_xy)
+
     def close(self):
-        pass
+        for page in self.pages.values():
+            if page is not None:
+                page.release()
+        self.pages.clear()
+        if pe.settings.config.debug:
+            print(f"Frame cache: {len(FRAME_CACHE)} frames, {FRAME_CACHE.size_bytes} bytes, {FRAME_CACHE.stats}")
+            print(f"Parse cache: workers {get_shared_pool().cache_stats}, "
+                  f"main process {get_parse_cache(Defaults.PARSE_CACHE_PATH).stats}")
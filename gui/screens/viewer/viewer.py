@@ -82,8 +82,9 @@ class DocumentRenderer(pe.ChildContext):
         self.last_opened_uuid = self.document.content.c_pages.last_opened.value
         self.current_page_index = self.document.content.c_pages.get_index_from_uuid(self.last_opened_uuid) or 0
         self.renderer = None
+        self.notebook_renderer = None
         super().__init__(parent)
-        if self.config.notebook_render_mode == 'rm_lines_svg_inker':
+        if self.config.notebook_render_mode in ('rm_lines_svg_inker', 'rm_lines_raster_inker'):
             self.notebook_renderer = Notebook_rM_Lines_Renderer(self)
         else:
             self.close()
@@ -216,6 +217,8 @@ class DocumentRenderer(pe.ChildContext):
     def close(self):
         if self.renderer:
             self.renderer.close()
+        if self.notebook_renderer:
+            self.notebook_renderer.close()
 
     def post_loop(self):
         if self.error:
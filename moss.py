@@ -1,3 +1,4 @@
 from gui import run_gui
 
-run_gui()
+if __name__ == "__main__":
+    run_gui()
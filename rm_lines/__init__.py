@@ -1,15 +1,17 @@
-from io import BytesIO, StringIO
+from io import StringIO
 
 from rm_lines.inker.document_size_tracker import DocumentSizeTracker
 from .reader import read_tree
+from .blocks import probe, PageSummary, IncrementalTreeReader, BlockStreamParser, read_tree_from_chunks
 from .inker import tree_to_svg
 
 
-def rm_bytes_to_svg(data: bytes, track_xy: DocumentSizeTracker = None):
-    tree = read_tree(BytesIO(data))
+def rm_bytes_to_svg(data: bytes, track_xy: DocumentSizeTracker = None, options: dict = None):
+    tree = read_tree(data)
     with StringIO() as f:
-        tree_to_svg(tree, f, track_xy)
+        tree_to_svg(tree, f, track_xy, options)
         return f.getvalue()
 
 
-__all__ = ['read_tree', 'tree_to_svg']
+__all__ = ['read_tree', 'tree_to_svg', 'probe', 'PageSummary', 'IncrementalTreeReader',
+           'BlockStreamParser', 'read_tree_from_chunks']
@@ -0,0 +1,155 @@
+"""Add strokes to an existing page without rewriting it.
+
+Blocks are applied in order, so new items can be written as new blocks at the
+end of a page. `append_lines` produces those blocks for a list of lines; the
+result is meant to be concatenated onto the original page data::
+
+    data += append_lines(data, lines)
+
+Only the block headers and the ids of existing items are read, so the cost
+does not depend on how many points the page already holds.
+
+"""
+
+from __future__ import annotations
+
+from dataclasses import fields, is_dataclass
+from io import BytesIO
+import typing as tp
+
+from packaging.version import Version
+
+from .block_index import BlockIndex, BlockIndexEntry, build_block_index
+from .blocks import (
+    Block,
+    SceneItemBlock,
+    SceneLineItemBlock,
+    SceneTreeBlock,
+    read_blocks,
+)
+from .crdt_sequence import CrdtSequence, CrdtSequenceItem
+from .reader.reader import TaggedBlockReader
+from .tagged_block_common import CrdtId, LwwValue
+from .writer.writer import TaggedBlockWriter
+from . import scene_items as si
+
+# The layer created by default on new pages
+DEFAULT_LAYER_ID = CrdtId(0, 11)
+
+# Offset of the current version in a block header
+_BLOCK_VERSION_OFFSET = 6
+
+
+def _iter_crdt_ids(value) -> tp.Iterator[CrdtId]:
+    """Find all CrdtIds in a parsed block or value."""
+    if isinstance(value, CrdtId):
+        yield value
+    elif isinstance(value, CrdtSequenceItem):
+        yield from (value.item_id, value.left_id, value.right_id)
+        if isinstance(value.value, str) and value.value:
+            # Each character has its own id following the item id
+            yield CrdtId(value.item_id.part1, value.item_id.part2 + len(value.value) - 1)
+        else:
+            yield from _iter_crdt_ids(value.value)
+    elif isinstance(value, LwwValue):
+        yield value.timestamp
+        yield from _iter_crdt_ids(value.value)
+    elif isinstance(value, CrdtSequence):
+        for item in value.sequence_items():
+            yield from _iter_crdt_ids(item)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield from _iter_crdt_ids(key)
+            yield from _iter_crdt_ids(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _iter_crdt_ids(item)
+    elif isinstance(value, si.Line):
+        # Points hold no ids
+        yield from _iter_crdt_ids(value.move_id)
+    elif is_dataclass(value) and not isinstance(value, type):
+        for f in fields(value):
+            yield from _iter_crdt_ids(getattr(value, f.name))
+    elif isinstance(value, Block):
+        yield from _iter_crdt_ids(vars(value))
+
+
+def _read_item_header(stream: TaggedBlockReader, entry: BlockIndexEntry) -> CrdtSequenceItem[None]:
+    """Read the ids of a scene item block, leaving its value out."""
+    stream.data.seek(entry.offset)
+    with stream.read_block():
+        stream.read_id(1)
+        item = CrdtSequenceItem(
+            item_id=stream.read_id(2),
+            left_id=stream.read_id(3),
+            right_id=stream.read_id(4),
+            deleted_length=stream.read_int(5),
+            value=None,
+        )
+        stream.data.seek(stream.current_block.offset + stream.current_block.size)
+    return item
+
+
+def append_lines(
+        data: bytes,
+        lines: tp.Iterable[si.Line],
+        layer_id: CrdtId = DEFAULT_LAYER_ID,
+        author_id: int = 1,
+        index: tp.Optional[BlockIndex] = None,
+) -> bytes:
+    """Return blocks adding `lines` at the end of layer `layer_id` of page `data`.
+
+    The new items get ids from `author_id` numbered above every id already in
+    the page. The result is meant to be appended to `data`.
+
+    :param index: `BlockIndex` of `data`, built if missing or stale.
+    """
+    if index is None or not index.matches(data):
+        index = build_block_index(data)
+
+    if not any(
+            entry.block_type == SceneTreeBlock.BLOCK_TYPE and entry.node_id == layer_id
+            for entry in index.entries
+    ):
+        raise ValueError("Layer %s not in page" % (layer_id,))
+
+    # Items are identified by the index; everything else is small enough to
+    # read in full to find the ids it uses
+    max_counter = 0
+    for entry in index.entries:
+        for crdt_id in (entry.parent_id, entry.node_id):
+            if crdt_id is not None and crdt_id.part1 != 0:
+                max_counter = max(max_counter, crdt_id.part2)
+    other_blocks = read_blocks(
+        data, {"lazy_points": True}, index, lambda entry: entry.block_type != SceneLineItemBlock.BLOCK_TYPE
+    )
+    for block in other_blocks:
+        for crdt_id in _iter_crdt_ids(block):
+            # Ids from author 0 are special values, such as the layer ids and
+            # the anchors at the top and bottom of the page
+            if crdt_id.part1 != 0:
+                max_counter = max(max_counter, crdt_id.part2)
+
+    # Find the last item of the layer to append after
+    stream = TaggedBlockReader(data)
+    layer_items = []
+    line_version = 2
+    for entry in index.entries:
+        block_class = Block.lookup(entry.block_type)
+        if entry.parent_id == layer_id and block_class is not None and issubclass(block_class, SceneItemBlock):
+            layer_items.append(_read_item_header(stream, entry))
+        if entry.block_type == SceneLineItemBlock.BLOCK_TYPE:
+            line_version = data[entry.offset + _BLOCK_VERSION_OFFSET]
+    layer_order = CrdtSequence(layer_items).keys()
+    left_id = layer_order[-1] if layer_order else si.END_MARKER
+
+    # Write lines in the same version as the page's existing lines
+    output = BytesIO()
+    writer = TaggedBlockWriter(output, options={"version": Version("9999" if line_version >= 2 else "3.0")})
+    for counter, line in enumerate(lines, max_counter + 1):
+        item_id = CrdtId(author_id, counter)
+        block = SceneLineItemBlock(layer_id, CrdtSequenceItem(item_id, left_id, si.END_MARKER, 0, line))
+        block.write(writer)
+        left_id = item_id
+    writer.flush()
+    return output.getvalue()
@@ -0,0 +1,294 @@
+"""Time the parser and SVG inker on generated pages.
+
+Measures CRDT sorting, block reading, `CrdtId` operations and SVG output, as
+quoted in the history of those changes. Each checkout given is measured in its
+own process, so an older version of `rm_lines` can be compared side by side
+with this one::
+
+    git worktree add /tmp/rm-lines-before <commit>
+    python -m rm_lines.benchmark /tmp/rm-lines-before .
+
+Pages are generated by this version of `rm_lines` and are the same for every
+checkout. Measurements a checkout doesn't support (e.g. reading pages from
+bytes, or SVG options) are shown as "-". Times are the best of up to 5 runs.
+Checkouts with the old quadratic toposort take about a minute on the 10k item
+chain and nearly two hours on the 100k one.
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import io
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing as tp
+
+# Sizes of the generated cases
+CHAIN_LENGTHS = (10000, 100000)
+SMALL_LINE_COUNT = 20000
+CRDT_ID_COUNT = 200000
+
+# Modes of the SVG table, as (name, tree_to_svg options)
+SVG_MODES = (
+    ("polyline", None),
+    ("path, precision 3", {"compact_paths": True, "precision": 3}),
+    ("path, precision 2, no cmts", {"compact_paths": True, "precision": 2, "comments": False}),
+    ("path, precision 1, no cmts", {"compact_paths": True, "precision": 1, "comments": False}),
+)
+
+# Run in a new interpreter, with the checkout to measure first on the path.
+# This file is run directly, so it imports `rm_lines` from that checkout.
+_WORKER_BOOTSTRAP = (
+    "import runpy, sys; sys.path.insert(0, sys.argv[1]); "
+    "runpy.run_path(sys.argv[2], run_name='__benchmark_worker__')"
+)
+
+
+def best_time(function: tp.Callable[[], tp.Any], repeat: int = 5, budget: float = 2.0) -> float:
+    """Return the best time of `function` in ms, stopping early once `budget` seconds are spent."""
+    best = math.inf
+    spent = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        spent += elapsed
+        if spent > budget:
+            break
+    return best * 1000
+
+
+## Pages
+
+
+def _random_lines(rnd: random.Random, count: int, point_count: int, handwriting: bool):
+    from rm_lines import scene_items as si
+
+    lines = []
+    for _ in range(count):
+        x, y = rnd.uniform(0, 1300), rnd.uniform(0, 1800)
+        angle = rnd.uniform(0, math.pi * 2)
+        points = []
+        for _ in range(point_count):
+            if handwriting:
+                # Smooth curves, like pen strokes
+                angle += rnd.uniform(-0.3, 0.3)
+                x += 2 * math.cos(angle)
+                y += 2 * math.sin(angle)
+            else:
+                x, y = rnd.uniform(0, 1400), rnd.uniform(0, 1800)
+            points.append(si.Point(
+                x, y, rnd.randint(0, 200), rnd.randint(0, 255), rnd.randint(0, 40), rnd.randint(0, 255)
+            ))
+        lines.append(si.Line(
+            rnd.choice(list(si.PenColor)[:4]), rnd.choice(list(si.Pen)), points, rnd.choice((1.0, 1.5, 2.0)), 0.0
+        ))
+    return lines
+
+
+def _page(lines) -> bytes:
+    from rm_lines.annotate import append_lines
+    from rm_lines.blocks import blank_document, write_blocks
+
+    buf = io.BytesIO()
+    write_blocks(buf, list(blank_document()))
+    data = buf.getvalue()
+    return data + append_lines(data, lines)
+
+
+def make_pages(directory: str) -> dict[str, str]:
+    """Write the pages used by the benchmarks to `directory`, returning their paths."""
+    rnd = random.Random(1)
+    pages = {
+        # Many tiny line blocks, dominated by block overhead
+        "small_lines": _page(_random_lines(rnd, SMALL_LINE_COUNT, 2, False)),
+        # About 1 MB of scattered points
+        "large": _page(_random_lines(rnd, 300, 300, False)),
+        "handwriting": _page(_random_lines(rnd, 1500, 60, True)),
+    }
+    paths = {}
+    for name, data in pages.items():
+        paths[name] = os.path.join(directory, name + ".rm")
+        with open(paths[name], "wb") as f:
+            f.write(data)
+    return paths
+
+
+## Measurements, run in the worker
+
+
+def bench_toposort() -> dict[str, tp.Optional[float]]:
+    from rm_lines.crdt_sequence import CrdtSequenceItem, toposort_items
+    from rm_lines.tagged_block_common import CrdtId
+
+    results = {}
+    end = CrdtId(0, 0)
+    for length in CHAIN_LENGTHS:
+        # Each item to the right of the one before, listed in reverse
+        items = [
+            CrdtSequenceItem(CrdtId(1, i), CrdtId(1, i - 1) if i else end, end, 0, "a")
+            for i in reversed(range(length))
+        ]
+        results[f"{length}-item chain (ms)"] = best_time(lambda: list(toposort_items(items)), budget=10)
+    return results
+
+
+def bench_read(pages: dict[str, str]) -> dict[str, tp.Optional[float]]:
+    from rm_lines.blocks import read_blocks
+
+    with open(pages["small_lines"], "rb") as f:
+        data = f.read()
+    results = {"from BytesIO (ms)": best_time(lambda: list(read_blocks(io.BytesIO(data))))}
+    try:
+        list(read_blocks(data))
+    except Exception:
+        results["from bytes (ms)"] = None
+    else:
+        results["from bytes (ms)"] = best_time(lambda: list(read_blocks(data)))
+    return results
+
+
+def bench_crdt_id(pages: dict[str, str]) -> dict[str, tp.Optional[float]]:
+    from rm_lines.blocks import read_tree
+    from rm_lines.tagged_block_common import CrdtId
+
+    n = CRDT_ID_COUNT
+    rnd = random.Random(2)
+    pairs = [(rnd.randint(1, 3), rnd.randint(0, 1 << 40)) for _ in range(n)]
+    ids = [CrdtId(*pair) for pair in pairs]
+    by_id = {crdt_id: i for i, crdt_id in enumerate(ids)}
+    new_ids = [CrdtId(*pair) for pair in pairs]
+
+    tracemalloc.start()
+    kept = [CrdtId(*pair) for pair in pairs]
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+
+    with open(pages["large"], "rb") as f:
+        data = f.read()
+
+    return {
+        "construct (ms)": best_time(lambda: [CrdtId(*pair) for pair in pairs]),
+        "dict build (ms)": best_time(lambda: {crdt_id: i for i, crdt_id in enumerate(ids)}),
+        "dict lookup, new ids (ms)": best_time(lambda: [by_id[crdt_id] for crdt_id in new_ids]),
+        "sort (ms)": best_time(lambda: sorted(ids)),
+        "part1/part2 reads (ms)": best_time(lambda: [crdt_id.part1 + crdt_id.part2 for crdt_id in ids]),
+        # Less the list's own pointer to each id
+        "memory per id (B)": memory / n - 8,
+        "read_tree, 1 MB page (ms)": best_time(lambda: read_tree(io.BytesIO(data))),
+    }
+
+
+def bench_svg(pages: dict[str, str]) -> dict[str, tp.Optional[float]]:
+    import inspect
+    from xml.etree import ElementTree
+
+    from rm_lines.blocks import read_tree
+    from rm_lines.inker import tree_to_svg
+
+    has_options = "options" in inspect.signature(tree_to_svg).parameters
+    trees = []
+    for name in ("large", "handwriting"):
+        with open(pages[name], "rb") as f:
+            trees.append(read_tree(io.BytesIO(f.read())))
+
+    def write_all(options) -> list[str]:
+        svgs = []
+        for tree in trees:
+            with io.StringIO() as f:
+                if options is None:
+                    tree_to_svg(tree, f)
+                else:
+                    tree_to_svg(tree, f, None, options)
+                svgs.append(f.getvalue())
+        return svgs
+
+    results = {}
+    for mode, options in SVG_MODES:
+        if options is not None and not has_options:
+            svgs = None
+        else:
+            svgs = write_all(options)
+        encoded = [svg.encode() for svg in svgs] if svgs is not None else []
+        measured = {
+            "size (MB)": lambda: sum(map(len, encoded)) / 1e6,
+            "gzip (MB)": lambda: sum(len(gzip.compress(data)) for data in encoded) / 1e6,
+            "write (ms)": lambda: best_time(lambda: write_all(options)),
+            "XML parse (ms)": lambda: best_time(lambda: [ElementTree.fromstring(data) for data in encoded]),
+        }
+        for metric, measure in measured.items():
+            results[f"{mode}: {metric}"] = measure() if svgs is not None else None
+    return results
+
+
+BENCHMARKS = (
+    ("CRDT toposort", lambda pages: bench_toposort()),
+    (f"Reading {SMALL_LINE_COUNT} small line blocks", bench_read),
+    (f"CrdtId, {CRDT_ID_COUNT} ids", bench_crdt_id),
+    ("SVG of the large and handwriting pages", bench_svg),
+)
+
+
+def run_benchmarks(pages: dict[str, str]) -> dict[str, dict[str, tp.Optional[float]]]:
+    return {title: bench(pages) for title, bench in BENCHMARKS}
+
+
+def measure_checkout(root: str, pages: dict[str, str]) -> dict[str, dict[str, tp.Optional[float]]]:
+    """Run the benchmarks with the `rm_lines` of checkout `root` in a new process."""
+    with tempfile.TemporaryDirectory() as cwd:
+        output = subprocess.run(
+            [sys.executable, "-c", _WORKER_BOOTSTRAP, os.path.abspath(root), os.path.abspath(__file__),
+             json.dumps(pages)],
+            cwd=cwd, check=True, stdout=subprocess.PIPE, text=True,
+        ).stdout
+    return json.loads(output)
+
+
+def _format(value: tp.Optional[float]) -> str:
+    if value is None:
+        return "-"
+    return f"{value:.2f}" if value < 10 else f"{value:.0f}"
+
+
+def main(argv: tp.Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m rm_lines.benchmark",
+        description="Time rm_lines on generated pages, for one or more checkouts side by side.",
+    )
+    parser.add_argument(
+        "roots", nargs="*", default=[os.path.dirname(os.path.dirname(os.path.abspath(__file__)))],
+        help="checkouts to measure, each holding an rm_lines package (default: this one)",
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        pages = make_pages(directory)
+        results = [measure_checkout(root, pages) for root in args.roots]
+
+    names = [os.path.basename(os.path.abspath(root)) or root for root in args.roots]
+    for title, _ in BENCHMARKS:
+        rows = list(results[0][title])
+        width = max(map(len, rows))
+        print(f"{title}\n")
+        print("  " + " " * width + "".join(f"  {name:>12}" for name in names))
+        for row in rows:
+            print(f"  {row:<{width}}" + "".join(f"  {_format(result[title][row]):>12}" for result in results))
+        print()
+    return 0
+
+
+if __name__ == "__benchmark_worker__":
+    json.dump(run_benchmarks(json.loads(sys.argv[3])), sys.stdout)
+elif __name__ == "__main__":
+    sys.exit(main())
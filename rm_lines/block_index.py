@@ -0,0 +1,196 @@
+"""Index of the blocks in a reMarkable v6 file.
+
+Pages in the sync cache are immutable and stored under their hash, so the
+position of every block only needs to be found once. A `BlockIndex` records
+them and can be saved next to the cache, letting `read_blocks` and `read_tree`
+seek straight to the blocks a consumer needs.
+
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import os
+import struct
+import typing as tp
+import zlib
+
+from .blocks import (
+    Block,
+    RootTextBlock,
+    SceneItemBlock,
+    SceneTreeBlock,
+    TreeNodeBlock,
+)
+from .reader.reader import TaggedBlockReader
+from .tagged_block_common import CrdtId, TagType
+
+INDEX_MAGIC = b"rmLinesBlockIndex"
+INDEX_FORMAT_VERSION = 1
+INDEX_FILE_EXTENSION = ".rmidx"
+
+_HEADER = struct.Struct("<BQII")  # format version, data size, data crc32, entry count
+_ENTRY = struct.Struct("<BIIBBQBQ")  # type, offset, size, flags, parent id, node id
+_HAS_PARENT = 0x01
+_HAS_NODE = 0x02
+
+
+@dataclass
+class BlockIndexEntry:
+    """Position of a block and the ids it relates to.
+
+    `offset` is where the block header starts and `size` is the length of the
+    block contents, as in the header.
+
+    `node_id` is the id of the item or node the block describes (the item id
+    of scene items, the tree id of `SceneTreeBlock`, the node id of
+    `TreeNodeBlock`, the block id of `RootTextBlock`). `parent_id` is the
+    group the block belongs to, for scene items and `SceneTreeBlock`.
+
+    """
+
+    block_type: int
+    offset: int
+    size: int
+    parent_id: tp.Optional[CrdtId] = None
+    node_id: tp.Optional[CrdtId] = None
+
+
+@dataclass
+class BlockIndex:
+    """Index of all blocks of one file.
+
+    `data_size` and `data_crc32` identify the data the index was built from.
+    """
+
+    data_size: int
+    data_crc32: int
+    entries: list[BlockIndexEntry] = field(default_factory=list)
+
+    def matches(self, data: bytes) -> bool:
+        """Check if this index was built from `data`."""
+        return len(data) == self.data_size and zlib.crc32(data) == self.data_crc32
+
+    def to_bytes(self) -> bytes:
+        parts = [INDEX_MAGIC, _HEADER.pack(INDEX_FORMAT_VERSION, self.data_size, self.data_crc32, len(self.entries))]
+        for entry in self.entries:
+            flags = 0
+            parent_id = node_id = CrdtId(0, 0)
+            if entry.parent_id is not None:
+                flags |= _HAS_PARENT
+                parent_id = entry.parent_id
+            if entry.node_id is not None:
+                flags |= _HAS_NODE
+                node_id = entry.node_id
+            parts.append(_ENTRY.pack(
+                entry.block_type, entry.offset, entry.size, flags,
+                parent_id.part1, parent_id.part2, node_id.part1, node_id.part2,
+            ))
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> BlockIndex:
+        """Load an index, raising `ValueError` if it is not a valid index."""
+        if not data.startswith(INDEX_MAGIC):
+            raise ValueError("Not a block index")
+        pos = len(INDEX_MAGIC)
+        try:
+            version, data_size, data_crc32, count = _HEADER.unpack_from(data, pos)
+        except struct.error as e:
+            raise ValueError("Truncated block index") from e
+        if version != INDEX_FORMAT_VERSION:
+            raise ValueError("Unsupported block index version %d" % version)
+        pos += _HEADER.size
+        if len(data) != pos + count * _ENTRY.size:
+            raise ValueError("Block index size mismatch")
+        entries = []
+        for block_type, offset, size, flags, parent1, parent2, node1, node2 in _ENTRY.iter_unpack(data[pos:]):
+            entries.append(BlockIndexEntry(
+                block_type, offset, size,
+                parent_id=CrdtId(parent1, parent2) if flags & _HAS_PARENT else None,
+                node_id=CrdtId(node1, node2) if flags & _HAS_NODE else None,
+            ))
+        return cls(data_size, data_crc32, entries)
+
+
+def _read_entry_ids(stream: TaggedBlockReader, block_type: int) -> tuple[tp.Optional[CrdtId], tp.Optional[CrdtId]]:
+    """Read (parent id, node id) from the start of a block."""
+    block_class = Block.lookup(block_type)
+    if block_class is None:
+        return None, None
+    if issubclass(block_class, SceneItemBlock):
+        parent_id = stream.read_id(1)
+        return parent_id, stream.read_id(2)
+    if issubclass(block_class, SceneTreeBlock):
+        tree_id = stream.read_id(1)
+        stream.read_id(2)
+        stream.read_bool(3)
+        stream.data.read_tag(4, TagType.Length4)
+        stream.data.read_uint32()
+        return stream.read_id(1), tree_id
+    if issubclass(block_class, (TreeNodeBlock, RootTextBlock)):
+        return None, stream.read_id(1)
+    return None, None
+
+
+def build_block_index(data: bytes) -> BlockIndex:
+    """Index the blocks of reMarkable file `data` by walking the block headers."""
+    stream = TaggedBlockReader(data)
+    stream.read_header()
+    index = BlockIndex(len(data), zlib.crc32(data))
+    while True:
+        offset = stream.data.tell()
+        with stream.read_block() as block_info:
+            if block_info is None:
+                break
+            try:
+                parent_id, node_id = _read_entry_ids(stream, block_info.block_type)
+            except Exception:
+                # Leave it to read_blocks to report
+                parent_id = node_id = None
+            index.entries.append(BlockIndexEntry(
+                block_info.block_type, offset, block_info.size, parent_id, node_id
+            ))
+            stream.data.seek(block_info.offset + block_info.size)
+    return index
+
+
+def block_index_path(index_dir: str, blob_hash: str) -> str:
+    """Return where the index of the blob with `blob_hash` is stored."""
+    return os.path.join(index_dir, blob_hash + INDEX_FILE_EXTENSION)
+
+
+def load_block_index(path: str) -> tp.Optional[BlockIndex]:
+    """Load a saved index, or return None if it is missing or unreadable."""
+    try:
+        with open(path, "rb") as f:
+            return BlockIndex.from_bytes(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def save_block_index(index: BlockIndex, path: str):
+    """Save `index`, replacing the file atomically."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(index.to_bytes())
+    os.replace(temp_path, path)
+
+
+def cached_block_index(data: bytes, blob_hash: str, index_dir: str) -> BlockIndex:
+    """Return the index of `data`, loading it from `index_dir` if possible.
+
+    A missing or stale index is rebuilt and saved. Failing to save it is not an
+    error, the index is still returned.
+    """
+    path = block_index_path(index_dir, blob_hash)
+    index = load_block_index(path)
+    if index is not None and index.matches(data):
+        return index
+    index = build_block_index(data)
+    try:
+        save_block_index(index, path)
+    except OSError:
+        pass
+    return index
@@ -0,0 +1,310 @@
+"""Rewrite pages without their editing history.
+
+Every edit on the tablet appends blocks: deleted strokes stay behind as empty
+items and tombstones, deleted text leaves empty runs, and updated groups are
+written again. `compact_page` rewrites a page with only what is needed to draw
+it:
+
+- deleted items, tombstones and other items carrying no value are dropped, and
+  the remaining items of each group are chained in their current order;
+- deleted text runs are dropped, and runs of consecutive characters are
+  merged, keeping the character ids (text anchors and paragraph styles refer
+  to them);
+- only the `TreeNodeBlock` applied last for each group, the last root text
+  and the styles of characters still present are kept.
+
+The compacted page no longer holds the ids of the dropped items, so it should
+replace a page rather than be merged with other copies of it.
+
+Run as a script to see how much a directory of pages could be compacted::
+
+    python -m rm_lines.compact path/to/sync
+
+"""
+
+from __future__ import annotations
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from io import BytesIO, StringIO
+import os
+import re
+import sys
+import typing as tp
+
+from .block_index import build_block_index
+from .blocks import (
+    RootTextBlock,
+    SceneGlyphItemBlock,
+    SceneGroupItemBlock,
+    SceneItemBlock,
+    SceneLineItemBlock,
+    SceneTreeBlock,
+    TreeNodeBlock,
+    UnreadableBlock,
+    read_blocks,
+    read_tree,
+    write_blocks,
+)
+from .crdt_sequence import CrdtSequence, CrdtSequenceItem
+from .inker import tree_to_svg
+from .tagged_block_common import CrdtId
+from .text import expanded_text_spans, ordered_text_spans
+from .validate import is_lines_file
+from . import scene_items as si
+
+# Item blocks added to the scene tree by `build_tree`
+_TREE_ITEM_BLOCKS = (SceneGroupItemBlock, SceneLineItemBlock, SceneGlyphItemBlock)
+
+# Offset of the current version in a block header
+_BLOCK_VERSION_OFFSET = 6
+
+# Comments in the SVG, which name the ids of children and text lines
+_SVG_COMMENT = re.compile(r"^ *<!-- .* -->\n", re.MULTILINE)
+
+
+@dataclass
+class CompactionResult:
+    """Outcome of `compact_page`."""
+
+    data: bytes
+    original_size: int
+    dropped_blocks: int = 0
+    dropped_items: int = 0
+    merged_text_runs: int = 0
+
+    @property
+    def compacted_size(self) -> int:
+        return len(self.data)
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_size - self.compacted_size
+
+
+def _chain(items: list[CrdtSequenceItem], last_id: tp.Callable[[CrdtSequenceItem], CrdtId]) -> list[CrdtSequenceItem]:
+    """Link `items` one after the other, in the given order."""
+    chained = []
+    left_id = si.END_MARKER
+    for item in items:
+        chained.append(replace(item, left_id=left_id, right_id=si.END_MARKER))
+        left_id = last_id(item)
+    return chained
+
+
+def _last_char_id(item: CrdtSequenceItem) -> CrdtId:
+    if isinstance(item.value, str) and item.value:
+        return CrdtId(item.item_id.part1, item.item_id.part2 + len(item.value) - 1)
+    return item.item_id
+
+
+def _compact_text(text: si.Text, anchor_ids: set[CrdtId], result: CompactionResult) -> si.Text:
+    items = text.items.sequence_items()
+    spans = ordered_text_spans(items)
+    if spans is None:
+        spans = expanded_text_spans(items)
+
+    runs = []
+    for start_id, value, length in spans:
+        if value == "":
+            # Deleted characters, only needed where groups are anchored to them
+            for offset in range(length):
+                char_id = CrdtId(start_id.part1, start_id.part2 + offset)
+                if char_id in anchor_ids:
+                    runs.append(CrdtSequenceItem(char_id, si.END_MARKER, si.END_MARKER, 1, ""))
+            result.dropped_items += 1
+            continue
+        previous = runs[-1] if runs else None
+        if (
+                previous is not None
+                and isinstance(value, str)
+                and isinstance(previous.value, str)
+                and previous.value
+                and start_id.part1 == previous.item_id.part1
+                and start_id.part2 == _last_char_id(previous).part2 + 1
+        ):
+            runs[-1] = replace(previous, value=previous.value + value)
+            result.merged_text_runs += 1
+        else:
+            runs.append(CrdtSequenceItem(start_id, si.END_MARKER, si.END_MARKER, 0, value))
+
+    char_ids = set()
+    for item in runs:
+        if isinstance(item.value, str) and item.value:
+            char_ids.update(
+                CrdtId(item.item_id.part1, item.item_id.part2 + i) for i in range(len(item.value))
+            )
+        else:
+            char_ids.add(item.item_id)
+    styles = {
+        char_id: style
+        for char_id, style in text.styles.items()
+        # Ids from author 0 are special positions, such as the start of the text
+        if char_id in char_ids or char_id.part1 == 0
+    }
+    return replace(text, items=CrdtSequence(_chain(runs, _last_char_id)), styles=styles)
+
+
+def _writer_version(data: bytes, index) -> tp.Optional[str]:
+    """Guess the software version the page was written with from its blocks."""
+    tree_node_version = line_version = None
+    for entry in index.entries:
+        version = data[entry.offset + _BLOCK_VERSION_OFFSET]
+        if entry.block_type == SceneLineItemBlock.BLOCK_TYPE:
+            line_version = version
+        elif entry.block_type == TreeNodeBlock.BLOCK_TYPE:
+            tree_node_version = version
+    if line_version == 1:
+        return "3.0"
+    if tree_node_version == 1:
+        return "3.3"
+    return None
+
+
+def _rendered(data: bytes) -> str:
+    with StringIO() as f:
+        tree_to_svg(read_tree(data), f)
+        return _SVG_COMMENT.sub("", f.getvalue())
+
+
+def compact_page(data: bytes, options: tp.Optional[dict] = None, verify: bool = True) -> CompactionResult:
+    """Rewrite page `data` into its minimal equivalent.
+
+    :param options: writer options, see `write_blocks`. By default the version
+        is guessed from the page.
+    :param verify: check that the compacted page draws the same as the original
+        with `tree_to_svg`, raising `ValueError` if not. Comments in the SVG
+        are not compared, as they name the ids of dropped items.
+    """
+    index = build_block_index(data)
+    blocks = list(read_blocks(data, index=index, select=lambda entry: True))
+    for block in blocks:
+        if isinstance(block, UnreadableBlock):
+            raise ValueError("Can't compact page with unreadable block: %s" % block.error)
+
+    result = CompactionResult(b"", len(data))
+
+    # Current order of the items of each group, as the tree has them
+    sequences: dict[CrdtId, CrdtSequence] = {}
+    last_tree_node: dict[CrdtId, int] = {}
+    anchor_ids: set[CrdtId] = set()
+    last_root_text = None
+    seen_tree_ids = set()
+    for i, block in enumerate(blocks):
+        if isinstance(block, _TREE_ITEM_BLOCKS):
+            sequences.setdefault(block.parent_id, CrdtSequence()).add(block.item)
+        elif isinstance(block, TreeNodeBlock):
+            last_tree_node[block.group.node_id] = i
+            if block.group.anchor_id is not None:
+                anchor_ids.add(block.group.anchor_id.value)
+        elif isinstance(block, RootTextBlock):
+            last_root_text = i
+
+    # New left and right ids of the kept items
+    chained_items: dict[tuple[CrdtId, CrdtId], CrdtSequenceItem] = {}
+    for parent_id, sequence in sequences.items():
+        kept = [sequence._items[item_id] for item_id in sequence if sequence[item_id] is not None]
+        for item in _chain(kept, lambda item: item.item_id):
+            chained_items[parent_id, item.item_id] = item
+
+    compacted = []
+    for i, block in enumerate(blocks):
+        if isinstance(block, SceneItemBlock):
+            item = chained_items.get((block.parent_id, block.item.item_id))
+            if item is None:
+                result.dropped_items += 1
+                result.dropped_blocks += 1
+                continue
+            block = type(block)(block.parent_id, item, extra_data=block.extra_data)
+        elif isinstance(block, SceneTreeBlock):
+            if block.tree_id in seen_tree_ids:
+                result.dropped_blocks += 1
+                continue
+            seen_tree_ids.add(block.tree_id)
+        elif isinstance(block, TreeNodeBlock):
+            if last_tree_node[block.group.node_id] != i:
+                result.dropped_blocks += 1
+                continue
+        elif isinstance(block, RootTextBlock):
+            if i != last_root_text:
+                result.dropped_blocks += 1
+                continue
+            block = RootTextBlock(block.block_id, _compact_text(block.value, anchor_ids, result))
+        compacted.append(block)
+
+    if options is None:
+        version = _writer_version(data, index)
+        options = {"version": version} if version else None
+    output = BytesIO()
+    write_blocks(output, compacted, options)
+    if output.tell() >= len(data):
+        # Splitting text runs where other text was inserted can outweigh what
+        # was dropped; keep the page as it is then
+        return CompactionResult(data, len(data))
+    result.data = output.getvalue()
+
+    if verify and _rendered(result.data) != _rendered(data):
+        raise ValueError("Compacted page does not draw the same as the original")
+    return result
+
+
+def _compact_path(path: str) -> tuple[str, tp.Optional[CompactionResult], tp.Optional[str]]:
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        if not is_lines_file(data):
+            return path, None, None
+        return path, compact_page(data), None
+    except Exception as e:
+        return path, None, "%s: %s" % (type(e).__name__, e)
+
+
+def main(argv: tp.Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m rm_lines.compact",
+        description="Report how much the reMarkable lines files in a directory could be compacted. "
+                    "Files are not modified.",
+    )
+    parser.add_argument("directory", help="directory of page blobs, searched recursively")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes")
+    parser.add_argument("-n", "--top", type=int, default=10, help="number of pages with most savings to list")
+    args = parser.parse_args(argv)
+
+    paths = [
+        os.path.join(root, name)
+        for root, _, names in os.walk(args.directory)
+        for name in names
+    ]
+
+    results = []
+    failed = []
+    with ProcessPoolExecutor(args.jobs) as executor:
+        for path, result, error in executor.map(_compact_path, paths, chunksize=4):
+            if error is not None:
+                failed.append((path, error))
+            elif result is not None:
+                results.append((path, result))
+
+    results.sort(key=lambda path_result: path_result[1].bytes_saved, reverse=True)
+    for path, result in results[:args.top]:
+        if result.bytes_saved <= 0:
+            break
+        print(
+            f"{path}: {result.original_size} -> {result.compacted_size} bytes "
+            f"({result.dropped_items} items dropped, {result.merged_text_runs} text runs merged)"
+        )
+    for path, error in failed:
+        print(f"{path}: could not compact: {error}")
+
+    original = sum(result.original_size for _, result in results)
+    saved = sum(max(result.bytes_saved, 0) for _, result in results)
+    print(
+        f"{len(results)} pages, {original} bytes: {saved} bytes could be saved "
+        f"({saved / original * 100 if original else 0:.1f}%), {len(failed)} failed"
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
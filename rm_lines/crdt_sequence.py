@@ -36,12 +36,18 @@ class CrdtSequence(tp.Generic[_Ti]):
 
     Iterating through the `CrdtSequence` yields IDs following this order.
 
+    The order is computed once and cached until the sequence is modified.
+    Appending an item after the current last item extends the cached order in
+    place rather than invalidating it.
+
     """
 
     def __init__(self, items=None):
         if items is None:
             items = []
         self._items = {item.item_id: item for item in items}
+        self._order: tp.Optional[list[CrdtId]] = None
+        self._referenced_ids: tp.Optional[set[CrdtId]] = None
 
     def __eq__(self, other):
         if isinstance(other, CrdtSequence):
@@ -55,21 +61,34 @@ class CrdtSequence(tp.Generic[_Ti]):
 
     ## Access values, in order
 
+    def _sorted_ids(self) -> list[CrdtId]:
+        """Return the cached order, sorting the items if needed."""
+        if self._order is None:
+            self._order = list(toposort_items(self._items.values()))
+            self._referenced_ids = {
+                side_id
+                for item in self._items.values()
+                for side_id in (item.left_id, item.right_id)
+            }
+        return self._order
+
     def __iter__(self) -> tp.Iterator[CrdtId]:
         """Return ids in order"""
-        yield from toposort_items(self._items.values())
+        return iter(self._sorted_ids())
 
     def keys(self) -> list[CrdtId]:
         """Return CrdtIds in order."""
-        return list(self)
+        return list(self._sorted_ids())
 
     def values(self) -> list[_Ti]:
         """Return list of sorted values."""
-        return [self[item_id] for item_id in self]
+        items = self._items
+        return [items[item_id].value for item_id in self._sorted_ids()]
 
     def items(self) -> Iterable[tuple[CrdtId, _Ti]]:
         """Return list of sorted key, value pairs."""
-        return [(item_id, self[item_id]) for item_id in self]
+        items = self._items
+        return [(item_id, items[item_id].value) for item_id in self._sorted_ids()]
 
     def __getitem__(self, key: CrdtId) -> _Ti:
         """Return item with key"""
@@ -87,6 +106,27 @@ class CrdtSequence(tp.Generic[_Ti]):
         if item.item_id in self._items:
             raise ValueError("Already have item %s" % item.item_id)
         self._items[item.item_id] = item
+        if self._order is not None and self._extends_order(item):
+            self._order.append(item.item_id)
+            self._referenced_ids.add(item.left_id)
+        else:
+            self._order = None
+            self._referenced_ids = None
+
+    def _extends_order(self, item: CrdtSequenceItem[_Ti]) -> bool:
+        """Check if `item` sorts after every item already in the order.
+
+        This holds when it follows the current last item and nothing else
+        refers to it. It is only safe to rely on when every item made it into
+        the order (i.e. there are no unresolvable items).
+        """
+        order = self._order
+        return (
+                item.right_id == END_MARKER
+                and len(order) == len(self._items) - 1
+                and (item.left_id == order[-1] if order else item.left_id == END_MARKER)
+                and item.item_id not in self._referenced_ids
+        )
 
 
 END_MARKER = CrdtId(0, 0)
@@ -105,41 +145,42 @@ def toposort_items(items: Iterable[CrdtSequenceItem]) -> Iterable[CrdtId]:
     if not item_dict:
         return  # nothing to do
 
-    def _side_id(item, side):
-        side_id = getattr(item, f"{side}_id")
-        if side_id == END_MARKER:
-            return "__start" if side == "left" else "__end"
-        else:
-            return side_id
-
     # build dictionary: key "comes after" values
     data = defaultdict(set)
     for item in item_dict.values():
-        left_id = _side_id(item, "left")
-        right_id = _side_id(item, "right")
+        left_id = "__start" if item.left_id == END_MARKER else item.left_id
+        right_id = "__end" if item.right_id == END_MARKER else item.right_id
         data[item.item_id].add(left_id)
         data[right_id].add(item.item_id)
 
-    # fill in sources not explicitly included
-    sources_not_in_data = {dep for deps in data.values() for dep in deps} - {
-        k for k in data.keys()
-    }
-    data.update({k: set() for k in sources_not_in_data})
-
-    while True:
-        next_items = {item for item, deps in data.items() if not deps}
-        if not next_items:
-            # Skips over the assert below, in most cases this is not a problem
+    # adjacency lists and in-degree counters, including sources not
+    # explicitly in data
+    dependents = defaultdict(list)
+    in_degree = {}
+    for key, deps in data.items():
+        in_degree[key] = len(deps)
+        for dep in deps:
+            dependents[dep].append(key)
+    for dep in dependents:
+        in_degree.setdefault(dep, 0)
+
+    # Emit in waves: everything whose dependencies have all been emitted, in
+    # sorted order, before moving on to the items this unblocks.
+    remaining = len(in_degree)
+    next_items = [key for key, count in in_degree.items() if count == 0]
+    while next_items:
+        if next_items == ["__end"]:
+            if remaining != 1:
+                raise ValueError("cyclic dependency")
             return
-        if next_items == {"__end"}:
-            break
-        assert next_items
         yield from sorted(k for k in next_items if k in item_dict)
-        data = {
-            item: (deps - next_items)
-            for item, deps in data.items()
-            if item not in next_items
-        }
-
-    if data != {"__end": set()}:
-        raise ValueError("cyclic dependency")
+        remaining -= len(next_items)
+        current_items = next_items
+        next_items = []
+        for key in current_items:
+            for dependent in dependents.get(key, ()):
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    next_items.append(dependent)
+    # Skips over the cyclic dependency check, in most cases this is not a
+    # problem
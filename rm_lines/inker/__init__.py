@@ -1,3 +1,4 @@
+from .raster import RasterScene, tree_to_raster
 from .svg import tree_to_svg
 
-__all__ = ["tree_to_svg"]
+__all__ = ["tree_to_svg", "tree_to_raster", "RasterScene"]
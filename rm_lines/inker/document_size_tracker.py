@@ -67,6 +67,19 @@ class DocumentSizeTracker(ABC):
             self.track_top = y
         return y
 
+    def track_points(self, xs, ys):
+        """Track many points at once, as calling `x` and `y` on each in turn.
+
+        Points within the tracked area change nothing, so they are only
+        tracked one by one if some are outside it.
+        """
+        if xs and (min(xs) + SCREEN_WIDTH / 2 < self.track_left or max(xs) + SCREEN_WIDTH / 2 > self.track_right):
+            for x in xs:
+                self.x(x)
+        if ys and (min(ys) < self.track_top or max(ys) > self.track_bottom):
+            for y in ys:
+                self.y(y)
+
     @property
     def format_kwargs(self):
         return {
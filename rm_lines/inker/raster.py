@@ -0,0 +1,403 @@
+"""Draw scene trees straight into RGBA pixel buffers.
+
+This is an alternative to `tree_to_svg` for showing pages on screen: rather
+than writing an SVG document for an image library to parse again, the strokes
+are drawn straight into an image. The image is a `RasterCanvas`: either a
+`bytearray` of RGBA pixels (`BufferCanvas`), or a `pygame.Surface` drawn by
+pygame (`PygameCanvas`), which is much faster.
+
+Strokes are drawn with the same `Pen` models as the SVG inker, split into the
+same segments. Drawing is done in two steps: `RasterScene.from_tree` works out
+the segments of every stroke in page coordinates once, then `RasterScene.render`
+fills them for any view of the page, so a page can be drawn at several frames
+and sizes without reading the tree again.
+
+Lines are not anti-aliased and text is not drawn, as with SVG images loaded by
+pygame.
+
+"""
+
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from array import array
+from dataclasses import dataclass, field
+import functools
+import itertools
+import math
+import typing as tp
+
+from .document_size_tracker import DocumentSizeTracker, NotebookSizeTracker, SCREEN_WIDTH
+from .svg import layout_text, stroke_segments
+from .writing_tools import Pen
+from ..scene_items import Group, Line
+from ..scene_tree import SceneTree
+from ..tagged_block_common import CrdtId
+from ..text import TextDocument
+
+try:
+    import pygame
+except ImportError:
+    pygame = None
+
+# Stroke widths of the pens are in tenths of the SVG stroke width
+_WIDTH_DIVISOR = 5
+
+# Strokes thinner than a pixel would mostly miss pixel centres
+_MIN_RADIUS = 0.5
+
+
+class RasterCanvas(ABC):
+    """Image that `RasterScene.render` draws strokes into."""
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+
+    @abstractmethod
+    def draw_polyline(self, xs: list[float], ys: list[float], radius: float, color: tuple[int, int, int],
+                      opacity: float, linecap: str):
+        """Draw a polyline with round joins, in pixel coordinates.
+
+        As with an SVG polyline, parts of the line covering each other are
+        only blended once.
+        """
+
+
+class BufferCanvas(RasterCanvas):
+    """RGBA pixels in a `bytearray`, row by row, with straight alpha.
+
+    This needs no other library, but filling pixels in Python is slow for
+    large images.
+    """
+
+    def __init__(self, width: int, height: int):
+        super().__init__(width, height)
+        self.data = bytearray(width * height * 4)
+
+    def draw_polyline(self, xs, ys, radius, color, opacity, linecap):
+        rows = _polyline_spans(xs, ys, radius, linecap, self.width, self.height)
+        _fill_spans(self.data, self.width, rows, color, opacity)
+
+
+class PygameCanvas(RasterCanvas):
+    """A `pygame.Surface` with per pixel alpha, drawn with `pygame.draw`."""
+
+    def __init__(self, width: int, height: int):
+        if pygame is None:
+            raise ImportError("PygameCanvas needs pygame")
+        super().__init__(width, height)
+        self.surface = pygame.Surface((width, height), pygame.SRCALPHA)
+
+    def draw_polyline(self, xs, ys, radius, color, opacity, linecap):
+        reach = math.ceil(radius * 1.5) + 1
+        if opacity >= 1:
+            target = self.surface
+            left = top = 0
+        else:
+            # Draw opaque on a layer, then blend the whole layer once
+            left = int(min(xs)) - reach
+            top = int(min(ys)) - reach
+            target = pygame.Surface((int(max(xs)) + reach - left + 1, int(max(ys)) + reach - top + 1),
+                                    pygame.SRCALPHA)
+        points = [(x - left, y - top) for x, y in zip(xs, ys)]
+        if linecap == "square" and len(points) > 1:
+            points[0] = _extend(points[1], points[0], radius)
+            points[-1] = _extend(points[-2], points[-1], radius)
+        width = max(round(radius * 2), 1)
+        if len(points) > 1:
+            pygame.draw.lines(target, color, False, points, width)
+        # Round joins, and round caps
+        for point in points if linecap == "round" else points[1:-1]:
+            pygame.draw.circle(target, color, point, radius)
+        if len(points) == 1 and linecap != "round":
+            pygame.draw.circle(target, color, points[0], radius)
+        if target is not self.surface:
+            target.set_alpha(round(opacity * 255))
+            self.surface.blit(target, (left, top))
+
+
+def _extend(previous: tuple[float, float], end: tuple[float, float], distance: float) -> tuple[float, float]:
+    """Move `end` away from `previous` by `distance`."""
+    dx = end[0] - previous[0]
+    dy = end[1] - previous[1]
+    length = math.hypot(dx, dy)
+    if length == 0:
+        return end
+    return end[0] + dx / length * distance, end[1] + dy / length * distance
+
+
+@dataclass
+class RasterStroke:
+    """Polyline drawn with one colour, width and opacity, in page coordinates."""
+
+    xs: array
+    ys: array
+    color: tuple[int, int, int]
+    width: float
+    opacity: float
+    linecap: str = "round"
+
+
+@dataclass
+class RasterScene:
+    """Strokes of a page, ready to be drawn at any view.
+
+    `track_xy` has the size of the page, as measured while reading the strokes.
+    """
+
+    track_xy: DocumentSizeTracker
+    strokes: list[RasterStroke] = field(default_factory=list)
+
+    @classmethod
+    def from_tree(cls, tree: SceneTree, track_xy: DocumentSizeTracker = None) -> RasterScene:
+        if track_xy is None:
+            track_xy = NotebookSizeTracker()
+        scene = cls(track_xy)
+
+        # These special anchor IDs are for the top and bottom of the page.
+        anchor_pos = {
+            CrdtId(0, 281474976710654): 270,
+            CrdtId(0, 281474976710655): 700,
+        }
+        if tree.root_text is not None:
+            for fmt, line, ids, pos_x, pos_y in layout_text(TextDocument.from_scene_item(tree.root_text)):
+                if line:
+                    track_xy.x(pos_x)
+                    track_xy.y(pos_y)
+                for k in ids:
+                    anchor_pos[k] = pos_y
+
+        scene._add_group(tree.root, anchor_pos, SCREEN_WIDTH / 2, 0)
+        return scene
+
+    @property
+    def viewbox(self) -> tuple[float, float, float, float]:
+        """View of the whole page, as in the `viewBox` of `tree_to_svg`."""
+        track_xy = self.track_xy
+        return track_xy.track_left, track_xy.track_top, track_xy.track_width, track_xy.track_height
+
+    def _add_group(self, item: Group, anchor_pos, offset_x: float, offset_y: float):
+        track_xy = self.track_xy
+        anchor_x = 0.0
+        anchor_y = 0.0
+        if item.anchor_id is not None:
+            assert item.anchor_origin_x is not None
+            anchor_x = item.anchor_origin_x.value
+            if item.anchor_id.value in anchor_pos:
+                anchor_y = anchor_pos[item.anchor_id.value]
+        offset_x += track_xy.x(anchor_x)
+        offset_y += track_xy.y(anchor_y)
+        for child in item.children.values():
+            if isinstance(child, Group):
+                self._add_group(child, anchor_pos, offset_x, offset_y)
+            elif isinstance(child, Line):
+                self._add_line(child, offset_x, offset_y)
+
+    def _add_line(self, item: Line, offset_x: float, offset_y: float):
+        """Split a line into segments the way `svg.draw_stroke` does."""
+        pen = Pen.cached(item.tool.value, item.color.value, item.thickness_scale / 10)
+        xs, ys, segments = stroke_segments(pen, item.points)
+        self.track_xy.track_points(xs, ys)
+        xs = [offset_x + x for x in xs]
+        ys = [offset_y + y for y in ys]
+
+        segment_length = pen.segment_length
+        for start, segment_width, opacity, color in zip(range(0, len(xs), segment_length), *segments):
+            # Join to previous segment
+            first = start - 1 if start > 0 else start
+            self.strokes.append(RasterStroke(
+                array("d", xs[first:start + segment_length]), array("d", ys[first:start + segment_length]),
+                color, segment_width / _WIDTH_DIVISOR, opacity, pen.stroke_linecap
+            ))
+
+    def render(
+            self,
+            viewbox: tp.Optional[tuple[float, float, float, float]] = None,
+            size: tp.Optional[tuple[int, int]] = None,
+            canvas_class: tp.Type[RasterCanvas] = BufferCanvas,
+    ) -> RasterCanvas:
+        """Draw the part of the page in `viewbox` into a new canvas of `size`.
+
+        As with an SVG `viewBox`, the view is scaled to fit the canvas keeping
+        its aspect ratio, and centred. By default the whole page is drawn at
+        its own size.
+        """
+        if viewbox is None:
+            viewbox = self.viewbox
+        view_x, view_y, view_width, view_height = viewbox
+        if size is None:
+            size = int(self.track_xy.track_width), int(self.track_xy.track_height)
+        canvas = canvas_class(*size)
+        if canvas.width <= 0 or canvas.height <= 0 or view_width <= 0 or view_height <= 0:
+            return canvas
+
+        scale = min(canvas.width / view_width, canvas.height / view_height)
+        shift_x = (canvas.width - view_width * scale) / 2 - view_x * scale
+        shift_y = (canvas.height - view_height * scale) / 2 - view_y * scale
+        for stroke in self.strokes:
+            if stroke.opacity <= 0 or stroke.width <= 0 or not stroke.xs:
+                continue
+            radius = max(stroke.width * scale / 2, _MIN_RADIUS)
+            xs = [x * scale + shift_x for x in stroke.xs]
+            ys = [y * scale + shift_y for y in stroke.ys]
+            reach = radius * 1.5
+            if (
+                    max(xs) < -reach or min(xs) > canvas.width + reach
+                    or max(ys) < -reach or min(ys) > canvas.height + reach
+            ):
+                continue
+            canvas.draw_polyline(xs, ys, radius, stroke.color, stroke.opacity, stroke.linecap)
+        return canvas
+
+
+def tree_to_raster(
+        tree: SceneTree,
+        track_xy: DocumentSizeTracker = None,
+        viewbox: tp.Optional[tuple[float, float, float, float]] = None,
+        size: tp.Optional[tuple[int, int]] = None,
+        canvas_class: tp.Type[RasterCanvas] = BufferCanvas,
+) -> RasterCanvas:
+    """Draw a tree into a new canvas. See `RasterScene.render`."""
+    return RasterScene.from_tree(tree, track_xy).render(viewbox, size, canvas_class)
+
+
+def _polyline_spans(xs, ys, radius, linecap, width, height) -> dict[int, list[list[int]]]:
+    """Return the pixels covered by a polyline with round joins.
+
+    Each segment is a band of half width `radius` around it, extended past the
+    ends of the polyline by `radius` for square caps, with discs at its ends
+    for round caps and joins. These shapes are convex and overlap, so their
+    union on a row of pixels is a single interval.
+
+    Pixels are returned as merged [first, last] column spans for each row.
+    """
+    rows: dict[int, list[list[int]]] = {}
+    round_cap = linecap == "round"
+    square_cap = linecap == "square"
+    radius_squared = radius * radius
+    last = len(xs) - 1
+    segments = [(i, i + 1) for i in range(last)] if last > 0 else [(0, 0)]
+    for start, end in segments:
+        ax, ay, bx, by = xs[start], ys[start], xs[end], ys[end]
+        start_disc = start > 0 or round_cap or start == end
+        end_disc = end < last or round_cap or start == end
+        start_extend = radius if start == 0 and square_cap else 0.0
+        end_extend = radius if end == last and square_cap else 0.0
+
+        length = math.hypot(bx - ax, by - ay)
+        if length > 0:
+            ux = (bx - ax) / length
+            uy = (by - ay) / length
+        reach = radius * 1.5 if square_cap else radius
+        first_row = max(int(min(ay, by) - reach), 0)
+        last_row = min(int(max(ay, by) + reach) + 1, height - 1)
+        for row in range(first_row, last_row + 1):
+            y = row + 0.5
+            low = math.inf
+            high = -math.inf
+            if start_disc and -radius <= y - ay <= radius:
+                half = math.sqrt(radius_squared - (y - ay) ** 2)
+                low = ax - half
+                high = ax + half
+            if end_disc and -radius <= y - by <= radius:
+                half = math.sqrt(radius_squared - (y - by) ** 2)
+                low = min(low, bx - half)
+                high = max(high, bx + half)
+            if length > 0:
+                # Where the distance along the segment is in range...
+                along = (y - ay) * uy - ax * ux
+                if ux > 1e-9:
+                    band_low = (-start_extend - along) / ux
+                    band_high = (length + end_extend - along) / ux
+                elif ux < -1e-9:
+                    band_low = (length + end_extend - along) / ux
+                    band_high = (-start_extend - along) / ux
+                elif -start_extend <= along <= length + end_extend:
+                    band_low = -math.inf
+                    band_high = math.inf
+                else:
+                    band_low = math.inf
+                    band_high = -math.inf
+                # ...and the distance across it is within the radius
+                across = (y - ay) * ux + ax * uy
+                if uy > 1e-9:
+                    band_low = max(band_low, (across - radius) / uy)
+                    band_high = min(band_high, (across + radius) / uy)
+                elif uy < -1e-9:
+                    band_low = max(band_low, (across + radius) / uy)
+                    band_high = min(band_high, (across - radius) / uy)
+                elif not -radius <= across <= radius:
+                    band_low = math.inf
+                if band_low <= band_high:
+                    low = min(low, band_low)
+                    high = max(high, band_high)
+            if low > high:
+                continue
+            # Pixels whose centre is in the interval
+            first = max(math.ceil(low - 0.5), 0)
+            last_column = min(math.floor(high - 0.5), width - 1)
+            if first <= last_column:
+                rows.setdefault(row, []).append([first, last_column])
+
+    for row, spans in rows.items():
+        if len(spans) == 1:
+            continue
+        spans.sort()
+        merged = [spans[0]]
+        for span in spans[1:]:
+            if span[0] <= merged[-1][1] + 1:
+                if span[1] > merged[-1][1]:
+                    merged[-1][1] = span[1]
+            else:
+                merged.append(span)
+        rows[row] = merged
+    return rows
+
+
+def _fill_spans(data: bytearray, width: int, rows: dict[int, list[list[int]]], color, opacity: float):
+    """Draw `color` over the pixels of `rows` in RGBA `data`, with straight alpha."""
+    row_size = width * 4
+    red, green, blue = color
+    if opacity >= 1:
+        pixel = bytes((red, green, blue, 255))
+        for row, spans in rows.items():
+            for first, last in spans:
+                data[row * row_size + first * 4:row * row_size + last * 4 + 4] = pixel * (last - first + 1)
+        return
+
+    alpha = round(opacity * 255)
+    pixel = bytes((red, green, blue, alpha))
+    for row, spans in rows.items():
+        for first, last in spans:
+            start = row * row_size + first * 4
+            end = row * row_size + last * 4 + 4
+            alphas = data[start + 3:end:4]
+            if alphas.count(0) == last - first + 1:
+                data[start:end] = pixel * (last - first + 1)
+                continue
+            for below, run in itertools.groupby(alphas):
+                count = len(list(run))
+                run_end = start + count * 4
+                if below == 0:
+                    data[start:run_end] = pixel * count
+                else:
+                    for channel, table in enumerate(_blend_tables(color, alpha, below)):
+                        data[start + channel:run_end:4] = data[start + channel:run_end:4].translate(table)
+                start = run_end
+
+
+@functools.lru_cache(maxsize=1024)
+def _blend_tables(color: tuple[int, int, int], alpha: int, below: int) -> tuple[bytes, ...]:
+    """Return tables blending `color` of `alpha` over each channel value.
+
+    The tables are for pixels of alpha `below`, blending with straight alpha.
+    The last one maps that alpha to the blended alpha.
+    """
+    opacity = alpha / 255
+    below = below / 255
+    out = opacity + below * (1 - opacity)
+    step = below * (1 - opacity) / out
+    tables = [bytes([int(c * opacity / out + v * step + 0.5) for v in range(256)]) for c in color]
+    tables.append(bytes([round(out * 255)]) * 256)
+    return tuple(tables)
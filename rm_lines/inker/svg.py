@@ -3,17 +3,16 @@
 Code originally from https://github.com/lschwetlick/maxio through
 https://github.com/chemag/maxio .
 """
-import io
 from pathlib import Path
 
-from typing import Union
+from typing import Optional, Union
 
 from rm_lines.inker.document_size_tracker import DocumentSizeTracker, NotebookSizeTracker
 
 from .writing_tools import (
     Pen,
 )
-from ..scene_items import ParagraphStyle, Group, Line, Text
+from ..scene_items import ParagraphStyle, Group, Line, PointArrays, Text
 from ..scene_tree import SceneTree
 from ..tagged_block_common import CrdtId
 from ..text import TextDocument
@@ -40,6 +39,9 @@ LINE_HEIGHTS = {
     # line, but there is still something a bit odd going on here.
 }
 
+# Coordinates of a point in a polyline
+_POINT_FORMAT = '{:.3f},{:.3f} '.format
+
 # <html>
 # <body>
 # <div style="border: 1px solid grey; margin: 2em; float: left;">
@@ -49,15 +51,63 @@ SVG_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
 """
 
 
+class _Numbers(dict):
+    """Shortest text of numbers in units of 10 ** -precision, by number."""
+
+    def __init__(self, precision: int):
+        super().__init__()
+        self.precision = precision
+        self.scale = 10 ** precision
+
+    def __missing__(self, value: int) -> str:
+        whole, fraction = divmod(abs(value), self.scale)
+        fraction = str(fraction).rjust(self.precision, '0').rstrip('0') if self.precision else ''
+        if fraction:
+            text = f'{whole or ""}.{fraction}'
+        else:
+            text = str(whole)
+        if value < 0:
+            text = '-' + text
+        self[value] = text
+        return text
+
+
 class SvgWriter:
-    def __init__(self):
-        self._output = io.StringIO()
+    """Collects the parts of the document body, to be written out in one go.
+
+    The body is never joined or scanned, so it can hold any text.
+
+    Options, see `tree_to_svg`, are read once here for all drawing functions.
+    """
+
+    def __init__(self, options: Optional[dict] = None):
+        if options is None:
+            options = {}
+        self.options = options
+        self.compact_paths = options.get("compact_paths", False)
+        self.precision = options.get("precision", 3)
+        self.comments = options.get("comments", True)
+        self._parts = []
+        self.numbers = _Numbers(self.precision)
+        self._scale = 10 ** self.precision
+        if self.precision == 3:
+            self.point_format = _POINT_FORMAT
+        else:
+            self.point_format = f'{{:.{self.precision}f}},{{:.{self.precision}f}} '.format
+
+    def number(self, value: int) -> str:
+        """Format `value`, in units of the precision, as short as possible."""
+        return self.numbers[value]
+
+    def float(self, value: float) -> str:
+        """Format `value` to the precision, as short as possible."""
+        return self.number(round(value * self._scale))
 
     def write(self, text):
-        self._output.write(text)
+        self._parts.append(text)
 
-    def format(self, **kwargs):
-        return self._output.getvalue().format(**kwargs)
+    def write_to(self, output_file):
+        output_file.writelines(self._parts)
 
 
 def read_template_svg(template_path: Path) -> str:
@@ -65,18 +115,27 @@ def read_template_svg(template_path: Path) -> str:
     return "\n".join(lines[2:-1])
 
 
-def tree_to_svg(tree: SceneTree, output_file, track_xy: DocumentSizeTracker = None):
-    """Convert Tree to SVG."""
+def tree_to_svg(tree: SceneTree, output_file, track_xy: DocumentSizeTracker = None,
+                options: Optional[dict] = None):
+    """Convert Tree to SVG.
+
+    Options:
+
+    - "compact_paths": draw stroke segments as `<path>` elements with relative
+      coordinates rather than `<polyline>` elements, dropping points within
+      rounding distance of a straight line through their neighbours, and
+      rounding widths and opacities too. This makes much smaller documents,
+      at the cost of exact coordinates.
+    - "precision": number of decimals of coordinates, 3 by default.
+    - "comments": whether to write comments naming the children, strokes and
+      text lines, True by default.
+
+    """
 
     if track_xy is None:
         track_xy = NotebookSizeTracker()
-    output = SvgWriter()
-
-    # add svg header
-    # output.write('<svg xmlns="http://www.w3.org/2000/svg">\n')
-    output.write(SVG_HEADER)
+    output = SvgWriter(options)
 
-    output.write('    <g id="p1" style="display:inline" transform="translate({x_shift},0)">\n')
     # output.write('        <filter id="blurMe"><feGaussianBlur in="SourceGraphic" stdDeviation="10" /></filter>\n')
 
     # These special anchor IDs are for the top and bottom of the page.
@@ -97,7 +156,13 @@ def tree_to_svg(tree: SceneTree, output_file, track_xy: DocumentSizeTracker = No
     output.write('    </g>\n')
     # END notebook
     output.write('</svg>\n')
-    output_file.write(output.format(**track_xy.format_kwargs))
+
+    # add svg header, now that the size of the document is known
+    # output.write('<svg xmlns="http://www.w3.org/2000/svg">\n')
+    format_kwargs = track_xy.format_kwargs
+    output_file.write(SVG_HEADER.format(**format_kwargs))
+    output_file.write(f'    <g id="p1" style="display:inline" transform="translate({format_kwargs["x_shift"]},0)">\n')
+    output.write_to(output_file)
 
 
 def draw_group(item: Group, output, anchor_pos, track_xy: DocumentSizeTracker):
@@ -111,7 +176,8 @@ def draw_group(item: Group, output, anchor_pos, track_xy: DocumentSizeTracker):
     output.write(f'    <g id="{item.node_id}" transform="translate({track_xy.x(anchor_x)}, {track_xy.y(anchor_y)})">\n')
     for child_id in item.children:
         child = item.children[child_id]
-        output.write(f'    <!-- child {child_id} -->\n')
+        if output.comments:
+            output.write(f'    <!-- child {child_id} -->\n')
         if isinstance(child, Group):
             draw_group(child, output, anchor_pos, track_xy=track_xy)
         elif isinstance(child, Line):
@@ -121,56 +187,182 @@ def draw_group(item: Group, output, anchor_pos, track_xy: DocumentSizeTracker):
 
 def draw_stroke(item: Line, output, track_xy: DocumentSizeTracker):
     # initiate the pen
-    pen = Pen.create(item.tool.value, item.color.value, item.thickness_scale / 10)
+    pen = Pen.cached(item.tool.value, item.color.value, item.thickness_scale / 10)
     K = 5
 
+    xs, ys, segments = stroke_segments(pen, item.points)
+    track_xy.track_points(xs, ys)
+
+    parts = []
+    if output.comments:
+        parts.append(
+            f'        <!-- Stroke tool: {item.tool.name} color: {item.color.name} thickness_scale: {item.thickness_scale} -->\n'
+        )
+    if output.compact_paths:
+        _draw_segment_paths(pen, xs, ys, segments, parts, output)
+        output.write(''.join(parts))
+        return
+
+    # Every point, ready to be added to a polyline
+    coordinates = list(map(output.point_format, xs, ys))
+
     # BEGIN stroke
-    output.write(
-        f'        <!-- Stroke tool: {item.tool.name} color: {item.color.name} thickness_scale: {item.thickness_scale} -->\n')
-    output.write('        <polyline ')
-    output.write(
-        f'style="fill:none;stroke:{pen.stroke_color};stroke-width:{pen.stroke_width / K};opacity:{pen.stroke_opacity}" ')
-    output.write(f'stroke-linecap="{pen.stroke_linecap}" ')
-    output.write(f'stroke-linejoin="{pen.stroke_linejoin}" ')
-    output.write('points="')
-
-    last_xpos = -1.
-    last_ypos = -1.
-    last_segment_width = segment_width = 0
-    # Iterate through the point to form a polyline
-    for point_id, point in enumerate(item.points):
-        # align the original position
-        xpos = point.x
-        ypos = point.y
-        if point_id % pen.segment_length == 0:
-            segment_color = pen.get_segment_color(point.speed, point.direction, point.width, point.pressure,
-                                                  last_segment_width)
-            segment_width = pen.get_segment_width(point.speed, point.direction, point.width, point.pressure,
-                                                  last_segment_width)
-            segment_opacity = pen.get_segment_opacity(point.speed, point.direction, point.width, point.pressure,
-                                                      last_segment_width)
-            # print(segment_color, segment_width, segment_opacity, pen.stroke_linecap)
-            # UPDATE stroke
-            output.write('"/>\n')
-            output.write('        <polyline ')
-            output.write(
-                f'style="fill:none; stroke:{segment_color} ;stroke-width:{segment_width / K:.3f};opacity:{segment_opacity}" ')
-            output.write(f'stroke-linecap="{pen.stroke_linecap}" ')
-            output.write(f'stroke-linejoin="{pen.stroke_linejoin}" ')
-            output.write('points="')
-            if last_xpos != -1.:
-                # Join to previous segment
-                output.write(a := f'{track_xy.x(last_xpos):.3f},{track_xy.y(last_ypos, ):.3f} ')
-        # store the last position
-        last_xpos = xpos
-        last_ypos = ypos
-        last_segment_width = segment_width
-
-        # BEGIN and END polyline segment
-        output.write(f'{track_xy.x(xpos):.3f},{track_xy.y(ypos):.3f} ')
+    parts.append(
+        f'        <polyline '
+        f'style="fill:none;stroke:{pen.stroke_color};stroke-width:{pen.stroke_width / K};opacity:{pen.stroke_opacity}" '
+        f'stroke-linecap="{pen.stroke_linecap}" '
+        f'stroke-linejoin="{pen.stroke_linejoin}" '
+        f'points="'
+    )
+
+    segment_length = pen.segment_length
+    # Each segment is a polyline starting at every `segment_length` points
+    for start, segment_width, segment_opacity, segment_rgb in zip(
+            range(0, len(coordinates), segment_length), *segments
+    ):
+        # UPDATE stroke
+        parts.append(
+            f'"/>\n'
+            f'        <polyline '
+            f'style="fill:none; stroke:rgb{segment_rgb} ;stroke-width:{segment_width / K:.3f};opacity:{segment_opacity}" '
+            f'stroke-linecap="{pen.stroke_linecap}" '
+            f'stroke-linejoin="{pen.stroke_linejoin}" '
+            f'points="'
+        )
+        if start > 0:
+            # Join to previous segment
+            parts.append(coordinates[start - 1])
+        parts.extend(coordinates[start:start + segment_length])
 
     # END stroke
-    output.write('" />\n')
+    parts.append('" />\n')
+    output.write(''.join(parts))
+
+
+def stroke_segments(pen: Pen, points):
+    """Return the x and y coordinates of `points`, and the segments `pen` draws them with.
+
+    Segments are given as lists of widths, opacities and colours, see
+    `Pen.get_segments`.
+    """
+    segment_length = pen.segment_length
+    # Pen inputs at the start of each segment
+    if isinstance(points, PointArrays):
+        xs = points.x
+        ys = points.y
+        segments = pen.get_segments(
+            points.speed[::segment_length], points.direction[::segment_length],
+            points.width[::segment_length], points.pressure[::segment_length],
+        )
+    else:
+        xs = [point.x for point in points]
+        ys = [point.y for point in points]
+        segment_points = points[::segment_length]
+        segments = pen.get_segments(
+            [point.speed for point in segment_points], [point.direction for point in segment_points],
+            [point.width for point in segment_points], [point.pressure for point in segment_points],
+        )
+    return xs, ys, segments
+
+
+def _draw_segment_paths(pen: Pen, xs, ys, segments, parts: list[str], output: SvgWriter):
+    """Add a group of `<path>` elements drawing the segments of a stroke to `parts`.
+
+    Consecutive segments drawn the same once rounded share a path.
+    """
+    K = 5
+    scale = 10 ** output.precision
+    xs = [round(x * scale) for x in xs]
+    ys = [round(y * scale) for y in ys]
+
+    # Attributes of each path, with the range of points it goes through
+    paths = []
+    for start, segment_width, segment_opacity, (red, green, blue) in zip(
+            range(0, len(xs), pen.segment_length), *segments
+    ):
+        attributes = f'stroke="#{red:02x}{green:02x}{blue:02x}" stroke-width="{output.float(segment_width / K)}"'
+        opacity = output.float(segment_opacity)
+        if opacity != '1':
+            attributes += f' opacity="{opacity}"'
+        end = min(start + pen.segment_length, len(xs))
+        if paths and paths[-1][0] == attributes:
+            paths[-1][2] = end
+        else:
+            # Join to previous segment
+            paths.append([attributes, start - 1 if start > 0 else start, end])
+
+    parts.append(
+        f'        <g fill="none" stroke-linecap="{pen.stroke_linecap}" stroke-linejoin="{pen.stroke_linejoin}">\n'
+    )
+    for attributes, first, end in paths:
+        parts.append(f'        <path {attributes} d="{_path_data(xs, ys, first, end, output)}"/>\n')
+    parts.append('        </g>\n')
+
+
+def _path_data(xs: list[int], ys: list[int], start: int, end: int, output: SvgWriter) -> str:
+    """Return path data through points `start` to `end` of `xs` and `ys`.
+
+    Coordinates are in units of the precision. Points closer than half a unit
+    to the straight line through the points kept around them are dropped.
+    """
+    last_x = xs[start]
+    last_y = ys[start]
+    kept_x = [last_x]
+    kept_y = [last_y]
+    # Points dropped since the last kept corner, checked again as the line grows
+    dropped = []
+    for x, y in zip(xs[start + 1:end], ys[start + 1:end]):
+        if x == last_x and y == last_y:
+            continue
+        if len(kept_x) >= 2:
+            corner_x = kept_x[-2]
+            corner_y = kept_y[-2]
+            line_x = x - corner_x
+            line_y = y - corner_y
+            limit = (line_x * line_x + line_y * line_y) / 4
+            cross = (last_x - corner_x) * line_y - (last_y - corner_y) * line_x
+            if (
+                    0 < limit
+                    and cross * cross <= limit
+                    and (last_x - corner_x) * line_x + (last_y - corner_y) * line_y >= 0
+                    and (x - last_x) * line_x + (y - last_y) * line_y >= 0
+                    and all(_near_line(px, py, corner_x, corner_y, x, y, line_x, line_y, limit) for px, py in dropped)
+            ):
+                dropped.append((last_x, last_y))
+                kept_x[-1] = last_x = x
+                kept_y[-1] = last_y = y
+                continue
+            dropped.clear()
+        kept_x.append(x)
+        kept_y.append(y)
+        last_x = x
+        last_y = y
+
+    numbers = output.numbers
+    data = [f'M{numbers[kept_x[0]]} {numbers[kept_y[0]]}']
+    if len(kept_x) > 1:
+        data.append('l')
+        data.append(' '.join(
+            f'{numbers[x - previous_x]} {numbers[y - previous_y]}'
+            for previous_x, previous_y, x, y in zip(kept_x, kept_y, kept_x[1:], kept_y[1:])
+        ).replace(' -', '-'))
+    elif end - start > 1:
+        # Only repeated points: keep a dot, as the polyline would draw
+        data.append('l0 0')
+    return ''.join(data)
+
+
+def _near_line(px, py, corner_x, corner_y, x, y, line_x, line_y, limit) -> bool:
+    """Check if point p is close to the line from the corner to (x, y), and between them.
+
+    The line is (line_x, line_y) long; p is close if its distance times the
+    length of the line is at most `sqrt(limit)`.
+    """
+    return (
+            ((px - corner_x) * line_y - (py - corner_y) * line_x) ** 2 <= limit
+            and (px - corner_x) * line_x + (py - corner_y) * line_y >= 0
+            and (x - px) * line_x + (y - py) * line_y >= 0
+    )
 
 
 def draw_text(text: Union[Text, TextDocument], output, anchor_pos, track_xy: DocumentSizeTracker):
@@ -181,18 +373,35 @@ def draw_text(text: Union[Text, TextDocument], output, anchor_pos, track_xy: Doc
     # add some style to get readable text
     output.write('''
     <style>
-        text.heading {{
+        text.heading {
             font: 14pt serif;
-        }}
-        text.bold {{
+        }
+        text.bold {
             font: 8pt sans-serif bold;
-        }}
-        text, text.plain {{
+        }
+        text, text.plain {
             font: 7pt sans-serif;
-        }}
+        }
     </style>
     ''')
 
+    for fmt, line, ids, pos_x, pos_y in layout_text(text):
+        cls = fmt.name.lower()
+        if line:
+            if output.comments:
+                output.write(f'        <!-- Text line char_id: {ids[0]} -->\n')
+            output.write(
+                f'        <text x="{track_xy.x(pos_x)}" y="{track_xy.y(pos_y)}" class="{cls}">{line.strip()}</text>\n')
+
+        # Save y-coordinates of potential anchors
+        for k in ids:
+            anchor_pos[k] = pos_y
+
+    output.write('    </g>\n')
+
+
+def layout_text(text: TextDocument):
+    """Yield (style, line, char ids, x, y) for each paragraph of `text`."""
     y_offset = TEXT_TOP_Y
     pos_x = 0
     pos_y = 0
@@ -205,16 +414,5 @@ def draw_text(text: Union[Text, TextDocument], output, anchor_pos, track_xy: Doc
             ids = []
         y_offset += LINE_HEIGHTS[fmt]
 
-        pos_x
         pos_y += y_offset
-        cls = fmt.name.lower()
-        if line:
-            output.write(f'        <!-- Text line char_id: {ids[0]} -->\n')
-            output.write(
-                f'        <text x="{track_xy.x(pos_x)}" y="{track_xy.y(pos_y)}" class="{cls}">{line.strip()}</text>\n')
-
-        # Save y-coordinates of potential anchors
-        for k in ids:
-            anchor_pos[k] = pos_y
-
-    output.write('    </g>\n')
+        yield fmt, line, ids, pos_x, pos_y
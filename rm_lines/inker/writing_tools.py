@@ -2,8 +2,14 @@
 
 Code originally from https://github.com/lschwetlick/maxio through
 https://github.com/chemag/maxio .
+
+Pens draw a stroke as segments, each with its own width, opacity and colour
+worked out from the pen inputs at the start of the segment. The
+`get_segment_*` methods hold the formulas for one segment, and
+`Pen.get_segments` applies them to a whole stroke at once.
 """
 
+import functools
 import math
 
 # color_id to RGB conversion
@@ -32,10 +38,15 @@ remarkable_palette = {
 MAGIC_PENCIL_SIZE = 44.6 * 2.3
 
 
+def _alternating(count):
+    """Return `count` values alternating between 0 and 1, starting with 0."""
+    return [index % 2 for index in range(count)]
+
+
 class Pen:
     def __init__(self, base_width, base_color_id):
         self.base_width = base_width
-        self.base_color = remarkable_palette[base_color_id]
+        self.base_color_id = base_color_id
         self.segment_length = 1000
         self.base_opacity = 1
         self.name = "Basic Pen"
@@ -46,6 +57,11 @@ class Pen:
         self.stroke_width = base_width
         self.stroke_color = base_color_id
 
+    @property
+    def base_color(self):
+        # Read from the palette each time, as the palette can be changed
+        return remarkable_palette[self.base_color_id]
+
     # note that the units of the points have had their units converted
     # in scene_stream.py
     # speed = d.read_float32() * 4
@@ -65,12 +81,57 @@ class Pen:
     def get_segment_width(self, speed, direction, width, pressure, last_width):
         return self.base_width
 
+    def get_segment_rgb(self, speed, direction, width, pressure, last_width):
+        return tuple(self.base_color)
+
     def get_segment_color(self, speed, direction, width, pressure, last_width):
-        return "rgb" + str(tuple(self.base_color))
+        return "rgb" + str(self.get_segment_rgb(speed, direction, width, pressure, last_width))
 
     def get_segment_opacity(self, speed, direction, width, pressure, last_width):
         return self.base_opacity
 
+    def get_segments(self, speeds, directions, widths, pressures):
+        """Return the widths, opacities and RGB colours of the segments of a stroke.
+
+        Takes the pen inputs at the start of each segment, in sequences of the
+        same length, and returns one list for each of width, opacity and
+        colour, each worked out by the matching `get_segment_*` method. Unlike
+        calling those directly, this does not change the pen, so the same pen
+        can draw many strokes, see `Pen.cached`.
+        """
+        segment_widths = self.get_segment_widths(speeds, directions, widths, pressures)
+        # Width of the segment before each one
+        last_widths = [0, *segment_widths[:-1]]
+        return (
+            segment_widths,
+            self.get_segment_opacities(speeds, directions, widths, pressures, last_widths),
+            self.get_segment_rgbs(speeds, directions, widths, pressures, last_widths),
+        )
+
+    # Pens which keep a `get_segment_*` method of `Pen` draw every segment
+    # the same, so it is worked out once per stroke
+
+    def get_segment_widths(self, speeds, directions, widths, pressures):
+        if type(self).get_segment_width is Pen.get_segment_width:
+            return [self.base_width] * len(speeds)
+        get_segment_width = self.get_segment_width
+        segment_widths = []
+        last_width = 0
+        for speed, direction, width, pressure in zip(speeds, directions, widths, pressures):
+            last_width = get_segment_width(speed, direction, width, pressure, last_width)
+            segment_widths.append(last_width)
+        return segment_widths
+
+    def get_segment_opacities(self, speeds, directions, widths, pressures, last_widths):
+        if type(self).get_segment_opacity is Pen.get_segment_opacity:
+            return [self.base_opacity] * len(speeds)
+        return list(map(self.get_segment_opacity, speeds, directions, widths, pressures, last_widths))
+
+    def get_segment_rgbs(self, speeds, directions, widths, pressures, last_widths):
+        if type(self).get_segment_rgb is Pen.get_segment_rgb:
+            return [tuple(self.base_color)] * len(speeds)
+        return list(map(self.get_segment_rgb, speeds, directions, widths, pressures, last_widths))
+
     def cutoff(self, value):
         """must be between 1 and 0"""
         value = 1 if value > 1 else value
@@ -114,6 +175,17 @@ class Pen:
             return Eraser(width, color_id)
         raise Exception(f'Unknown pen_nr: {pen_nr}')
 
+    @classmethod
+    @functools.lru_cache(maxsize=256)
+    def cached(cls, pen_nr, color_id, width):
+        """Return a pen shared by strokes of the same tool, colour and width.
+
+        Only the most recently used pens are kept. Shared pens should only be
+        used through `get_segments`, as the `get_segment_*` methods of some
+        pens change them.
+        """
+        return cls.create(pen_nr, color_id, width)
+
 
 class Fineliner(Pen):
     last = 0
@@ -138,22 +210,32 @@ class Ballpoint(Pen):
     #     TODO: Maybe implement a way for pens to have densities
 
     def get_segment_width(self, speed, direction, width, pressure, last_width):
-        segment_width = (0.5 + pressure / 100) + (1 * width / 4) - 0.5 * ((speed / 4) / 50)
-        segment_width *= 2
-        intensity = self.get_intensity(speed, pressure)
-        return segment_width * (1 if self.alternate == 0 else intensity) * 2.3
+        return self._segment_width(speed, width, pressure, self.alternate)
 
     def get_intensity(self, speed, pressure):
         return self.cutoff((0.1 * - ((speed / 4) / 35)) + (1.2 * pressure / 255) + 0.5)
 
     def get_segment_opacity(self, speed, direction, width, pressure, last_width):
+        opacity = self._segment_opacity(speed, pressure, self.alternate)
+        self.alternate = 1 - self.alternate
+        return opacity
+
+    def _segment_width(self, speed, width, pressure, alternate):
+        segment_width = (0.5 + pressure / 100) + (1 * width / 4) - 0.5 * ((speed / 4) / 50)
+        segment_width *= 2
         intensity = self.get_intensity(speed, pressure)
-        if self.alternate == 0:
-            self.alternate = 1
-            return intensity
-        else:
-            self.alternate = 0
-            return 1
+        return segment_width * (1 if alternate == 0 else intensity) * 2.3
+
+    def _segment_opacity(self, speed, pressure, alternate):
+        return self.get_intensity(speed, pressure) if alternate == 0 else 1
+
+    # Segments alternate as if drawn by a new pen, starting with `alternate` at 0
+
+    def get_segment_widths(self, speeds, directions, widths, pressures):
+        return list(map(self._segment_width, speeds, widths, pressures, _alternating(len(speeds))))
+
+    def get_segment_opacities(self, speeds, directions, widths, pressures, last_widths):
+        return list(map(self._segment_opacity, speeds, pressures, _alternating(len(speeds))))
 
     # def get_segment_color(self, speed, direction, width, pressure, last_width):
     #     segment_color = tuple(int(v * alpha) for v in self.base_color)
@@ -230,14 +312,12 @@ class Brush(Pen):
                 (speed / 4) / 50))  # + (0.2 * last_width)
         return segment_width
 
-    def get_segment_color(self, speed, direction, width, pressure, last_width):
+    def get_segment_rgb(self, speed, direction, width, pressure, last_width):
         intensity = ((pressure / 255) ** 1.5 - 0.2 * ((speed / 4) / 50)) * 1.5
         intensity = self.cutoff(intensity)
         # using segment color not opacity because the dots interfere with each other.
         # Color must be 255 rgb
-        segment_color = [int(intensity * i) for i in self.base_color]
-
-        return "rgb" + str(tuple(segment_color))
+        return tuple(int(intensity * i) for i in self.base_color)
 
 
 class Highlighter(Pen):
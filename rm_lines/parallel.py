@@ -0,0 +1,367 @@
+"""Parse many pages at once on a pool of worker processes.
+
+Parsing is pure Python, so threads do not help with large notebooks. The
+functions here parse pages in worker processes and send back compact results:
+`CompactPage` holds strokes as columns of arrays and text as plain runs, and
+`RenderedPage` holds the SVG of a page, both of which are cheap to pickle.
+
+The worker processes are started on first use and kept for later calls, see
+`PageParserPool` and `get_shared_pool`. Each worker has its own `ParseCache`,
+and sends back what its cache did with every result, which the pool adds up in
+`PageParserPool.cache_stats`.
+
+"""
+
+from __future__ import annotations
+
+from array import array
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from io import StringIO
+import multiprocessing
+import os
+import threading
+import typing as tp
+
+from .blocks import read_tree
+from .inker import tree_to_svg
+from .inker.document_size_tracker import DocumentSizeTracker
+from .parse_cache import ParseCacheStats, get_parse_cache
+from .scene_tree import SceneTree
+from .tagged_block_common import CrdtId
+from .text import TextDocument
+from . import scene_items as si
+
+# Page data, or the path of a file holding it
+PageSource = tp.Union[bytes, str, os.PathLike]
+
+# Columns of `CompactPage` holding one value per point
+POINT_COLUMNS = ("x", "y", "speed", "direction", "width", "pressure")
+
+# Memory budget of the parse caches of all workers of a pool together
+DEFAULT_CACHE_MEMORY_BYTES = 256 * 1024 * 1024
+
+# Memory budget of the parse cache of this worker process, set when it starts
+_worker_cache_memory_bytes: tp.Optional[int] = None
+
+
+@dataclass
+class TextRun:
+    """Span of text sharing one paragraph and formatting."""
+
+    text: str
+    paragraph: int
+    style: si.ParagraphStyle = si.ParagraphStyle.PLAIN
+    bold: bool = False
+    italic: bool = False
+
+
+@dataclass
+class CompactPage:
+    """Contents of a page as flat columns.
+
+    Stroke `i` has its points at `point_offsets[i]:point_offsets[i + 1]` in the
+    point columns (`x`, `y`, `speed`, `direction`, `width`, `pressure`).
+    `group_ids` is the group each stroke belongs to; groups are described in
+    `groups` as (parent group id, anchor id, anchor origin x, visible).
+
+    If the page could not be read, `error` describes why. `cache_stats` counts
+    what the worker's parse cache did to read the page, if it was used.
+
+    """
+
+    item_ids: list[CrdtId] = field(default_factory=list)
+    group_ids: list[CrdtId] = field(default_factory=list)
+    tools: array = field(default_factory=lambda: array("B"))
+    colors: array = field(default_factory=lambda: array("B"))
+    thickness_scales: array = field(default_factory=lambda: array("d"))
+    starting_lengths: array = field(default_factory=lambda: array("d"))
+    point_offsets: array = field(default_factory=lambda: array("q", [0]))
+
+    x: array = field(default_factory=lambda: array("d"))
+    y: array = field(default_factory=lambda: array("d"))
+    speed: array = field(default_factory=lambda: array("d"))
+    direction: array = field(default_factory=lambda: array("d"))
+    width: array = field(default_factory=lambda: array("d"))
+    pressure: array = field(default_factory=lambda: array("d"))
+
+    groups: dict[CrdtId, tuple[tp.Optional[CrdtId], tp.Optional[CrdtId], float, bool]] = field(default_factory=dict)
+
+    text_runs: list[TextRun] = field(default_factory=list)
+    # (pos_x, pos_y, width) of the root text
+    text_box: tp.Optional[tuple[float, float, float]] = None
+
+    error: tp.Optional[str] = None
+    cache_stats: tp.Optional[ParseCacheStats] = None
+
+    @property
+    def stroke_count(self) -> int:
+        return len(self.point_offsets) - 1
+
+    def stroke_points(self, index: int) -> si.PointArrays:
+        """Return the points of stroke `index`."""
+        start, end = self.point_offsets[index], self.point_offsets[index + 1]
+        return si.PointArrays(*(getattr(self, name)[start:end] for name in POINT_COLUMNS))
+
+    @classmethod
+    def from_tree(cls, tree: SceneTree) -> CompactPage:
+        page = cls()
+        page._add_group(tree.root, None)
+        if tree.root_text is not None:
+            page._add_text(tree.root_text)
+        return page
+
+    def _add_group(self, group: si.Group, parent_id: tp.Optional[CrdtId]):
+        self.groups[group.node_id] = (
+            parent_id,
+            group.anchor_id.value if group.anchor_id is not None else None,
+            group.anchor_origin_x.value if group.anchor_origin_x is not None else 0.0,
+            group.visible.value,
+        )
+        for item_id, child in group.children.items():
+            if isinstance(child, si.Group):
+                self._add_group(child, group.node_id)
+            elif isinstance(child, si.Line):
+                self._add_line(item_id, child, group.node_id)
+
+    def _add_line(self, item_id: CrdtId, line: si.Line, group_id: CrdtId):
+        self.item_ids.append(item_id)
+        self.group_ids.append(group_id)
+        self.tools.append(line.tool)
+        self.colors.append(line.color)
+        self.thickness_scales.append(line.thickness_scale)
+        self.starting_lengths.append(line.starting_length)
+
+        points = line.points
+        if not isinstance(points, si.PointArrays):
+            points = si.PointArrays.from_points(points)
+        for name in POINT_COLUMNS:
+            column = getattr(points, name)
+            target = getattr(self, name)
+            if column.typecode == target.typecode:
+                target.extend(column)
+            else:
+                target.fromlist(column.tolist())
+        self.point_offsets.append(self.point_offsets[-1] + len(points))
+
+    def _add_text(self, text: si.Text):
+        self.text_box = (text.pos_x, text.pos_y, text.width)
+        document = TextDocument.from_scene_item(text)
+        for index, paragraph in enumerate(document.contents):
+            for span in paragraph.contents:
+                self.text_runs.append(TextRun(
+                    span.s,
+                    index,
+                    paragraph.style.value,
+                    bold=span.properties.get("font-weight") == "bold",
+                    italic=span.properties.get("font-style") == "italic",
+                ))
+
+
+@dataclass
+class RenderedPage:
+    """SVG of a page, with the size tracker used to draw it.
+
+    If the page could not be rendered, `svg` is None and `error` describes why.
+    `cache_stats` is as in `CompactPage`.
+    """
+
+    svg: tp.Optional[str]
+    track_xy: tp.Optional[DocumentSizeTracker] = None
+    error: tp.Optional[str] = None
+    cache_stats: tp.Optional[ParseCacheStats] = None
+
+
+def _read_source(source: PageSource) -> bytes:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return source
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def _init_worker(cache_memory_bytes: tp.Optional[int]):
+    global _worker_cache_memory_bytes
+    _worker_cache_memory_bytes = cache_memory_bytes
+
+
+def _read_page_tree(
+        source: PageSource, blob_hash: tp.Optional[str], cache_dir: tp.Optional[str]
+) -> tuple[SceneTree, tp.Optional[ParseCacheStats]]:
+    """Read the tree of a page, and what the parse cache did to get it."""
+    if blob_hash is None:
+        return read_tree(_read_source(source), {"compact_points": True}), None
+    cache = get_parse_cache(cache_dir, _worker_cache_memory_bytes)
+    before = replace(cache.stats)
+    tree = cache.read_tree(lambda: _read_source(source), blob_hash)
+    # Workers read one page at a time, so the change is all from this page
+    return tree, cache.stats - before
+
+
+def parse_page(source: PageSource, blob_hash: str = None, cache_dir: str = None) -> CompactPage:
+    """Read a page into a `CompactPage`, recording errors rather than raising.
+
+    If `blob_hash` is given, the tree is looked up in the `ParseCache` saving
+    snapshots in `cache_dir`.
+    """
+    try:
+        tree, cache_stats = _read_page_tree(source, blob_hash, cache_dir)
+        page = CompactPage.from_tree(tree)
+        page.cache_stats = cache_stats
+        return page
+    except Exception as e:
+        return CompactPage(error="%s: %s" % (type(e).__name__, e))
+
+
+def render_page(
+        source: PageSource,
+        track_xy: DocumentSizeTracker = None,
+        blob_hash: str = None,
+        cache_dir: str = None,
+        options: dict = None,
+) -> RenderedPage:
+    """Render a page to SVG, recording errors rather than raising.
+
+    `blob_hash` and `cache_dir` are used as in `parse_page`, `options` are
+    passed to `tree_to_svg`.
+    """
+    try:
+        tree, cache_stats = _read_page_tree(source, blob_hash, cache_dir)
+        with StringIO() as f:
+            tree_to_svg(tree, f, track_xy, options)
+            return RenderedPage(f.getvalue(), track_xy, cache_stats=cache_stats)
+    except Exception as e:
+        return RenderedPage(None, track_xy, "%s: %s" % (type(e).__name__, e))
+
+
+class PageParserPool:
+    """Pool of worker processes parsing pages.
+
+    The processes are started when first needed and reused until `close`.
+    Workers are started with the "spawn" method, so the main module of the
+    program must not start the application when imported.
+
+    Each worker keeps recently parsed pages in its own `ParseCache`, so
+    `cache_memory_bytes` is split evenly between the workers. `cache_stats`
+    adds up the counters the workers send back with their results.
+
+    """
+
+    def __init__(self, max_workers: tp.Optional[int] = None, cache_memory_bytes: int = DEFAULT_CACHE_MEMORY_BYTES):
+        self.max_workers = max_workers
+        self.cache_memory_bytes = cache_memory_bytes
+        self.cache_stats = ParseCacheStats()
+        self._executor: tp.Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                workers = self.max_workers or os.cpu_count() or 1
+                self._executor = ProcessPoolExecutor(
+                    workers, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker, initargs=(self.cache_memory_bytes // workers,),
+                )
+            return self._executor
+
+    def _submit(self, fn, *args) -> Future:
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(self._add_cache_stats)
+        return future
+
+    def _add_cache_stats(self, future: Future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        cache_stats = future.result().cache_stats
+        if cache_stats is not None:
+            with self._lock:
+                self.cache_stats = self.cache_stats + cache_stats
+
+    def submit_parse(self, source: PageSource, blob_hash: str = None, cache_dir: str = None) -> Future:
+        """Parse one page, returning a future of its `CompactPage`.
+
+        See `parse_page` for `blob_hash` and `cache_dir`.
+        """
+        return self._submit(parse_page, source, blob_hash, cache_dir)
+
+    def submit_render(
+            self,
+            source: PageSource,
+            track_xy: DocumentSizeTracker = None,
+            blob_hash: str = None,
+            cache_dir: str = None,
+            options: dict = None,
+    ) -> Future:
+        """Render one page, returning a future of its `RenderedPage`.
+
+        The worker draws with a copy of `track_xy`; use the one returned in the
+        `RenderedPage`. See `parse_page` for `blob_hash` and `cache_dir`, and
+        `tree_to_svg` for `options`.
+        """
+        return self._submit(render_page, source, track_xy, blob_hash, cache_dir, options)
+
+    def parse_pages(
+            self,
+            sources: tp.Iterable[PageSource],
+            blob_hashes: tp.Optional[tp.Iterable[str]] = None,
+            cache_dir: str = None,
+    ) -> list[CompactPage]:
+        """Parse all pages in parallel, returning results in the same order."""
+        sources = list(sources)
+        blob_hashes = list(blob_hashes) if blob_hashes is not None else [None] * len(sources)
+        futures = [
+            self.submit_parse(source, blob_hash, cache_dir)
+            for source, blob_hash in zip(sources, blob_hashes)
+        ]
+        return [future.result() for future in futures]
+
+    def render_pages(
+            self,
+            sources: tp.Iterable[PageSource],
+            track_xy_factory: tp.Optional[tp.Callable[[], DocumentSizeTracker]] = None,
+            blob_hashes: tp.Optional[tp.Iterable[str]] = None,
+            cache_dir: str = None,
+            options: dict = None,
+    ) -> list[RenderedPage]:
+        """Render all pages to SVG in parallel, returning results in the same order.
+
+        :param track_xy_factory: called to make a size tracker for each page.
+        :param blob_hashes: hashes of the pages, to use the parse cache.
+        :param cache_dir: where the parse cache keeps its snapshots.
+        :param options: SVG options, see `tree_to_svg`.
+        """
+        sources = list(sources)
+        blob_hashes = list(blob_hashes) if blob_hashes is not None else [None] * len(sources)
+        futures = [
+            self.submit_render(
+                source, track_xy_factory() if track_xy_factory else None, blob_hash, cache_dir, options
+            )
+            for source, blob_hash in zip(sources, blob_hashes)
+        ]
+        return [future.result() for future in futures]
+
+    def close(self, wait: bool = True):
+        """Stop the worker processes. The pool starts new ones if used again."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_shared_pool: tp.Optional[PageParserPool] = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_shared_pool() -> PageParserPool:
+    """Return the pool shared by the whole program."""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = PageParserPool()
+        return _shared_pool
@@ -0,0 +1,514 @@
+"""Cache of parsed pages, in memory and on disk.
+
+Page blobs are immutable and identified by their hash, so a page only needs to
+be parsed once. `ParseCache` keeps recently used trees in memory and stores a
+snapshot of each tree on disk, which loads much faster than parsing the page
+again. Snapshots hold the strokes as flat arrays, the root text as its CRDT
+runs and the group hierarchy, see `tree_to_snapshot`.
+
+Entries are keyed by (blob hash, `PARSER_VERSION`, `SNAPSHOT_FORMAT`); bump
+the version whenever a change to the parser or to the snapshot format would give
+different trees. `SNAPSHOT_FORMAT` names the Python and marshal versions, as
+marshal data is not portable between them.
+
+"""
+
+from __future__ import annotations
+
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+import hashlib
+import marshal
+import os
+import sys
+import threading
+import typing as tp
+
+from .blocks import read_tree
+from .crdt_sequence import CrdtSequence, CrdtSequenceItem
+from .scene_tree import SceneTree
+from .tagged_block_common import CrdtId, LwwValue
+from . import scene_items as si
+
+PARSER_VERSION = 1
+
+SNAPSHOT_FORMAT = "py%d%d-m%d" % (sys.version_info[0], sys.version_info[1], marshal.version)
+SNAPSHOT_MAGIC = b"rmLinesTree" + SNAPSHOT_FORMAT.encode() + b"\0"
+SNAPSHOT_EXTENSION = ".rmtree"
+
+_POINT_COLUMNS = ("x", "y", "speed", "direction", "width", "pressure")
+
+# Kinds of values in group children
+_EMPTY, _GROUP, _LINE, _GLYPH = range(4)
+
+
+## Snapshots
+
+
+def _id(value: tp.Optional[CrdtId]) -> tp.Optional[tuple[int, int]]:
+    return None if value is None else (value.part1, value.part2)
+
+
+def _crdt_id(value: tp.Optional[tuple[int, int]]) -> tp.Optional[CrdtId]:
+    return None if value is None else CrdtId(*value)
+
+
+def _lww(value: tp.Optional[LwwValue], encode=None):
+    if value is None:
+        return None
+    return _id(value.timestamp), encode(value.value) if encode else value.value
+
+
+def _from_lww(value, decode=None) -> tp.Optional[LwwValue]:
+    if value is None:
+        return None
+    timestamp, v = value
+    return LwwValue(CrdtId(*timestamp), decode(v) if decode else v)
+
+
+class _LineTable:
+    """Strokes of a tree as columns, with their points concatenated.
+
+    Point columns keep the array type each line was read with, which is
+    recorded in `typecodes`.
+    """
+
+    def __init__(self):
+        self.colors = array("B")
+        self.tools = array("B")
+        self.thickness_scales = array("d")
+        self.starting_lengths = array("d")
+        self.move_ids = []
+        self.point_offsets = array("q", [0])
+        self.typecodes = []
+        self.columns = [bytearray() for _ in _POINT_COLUMNS]
+
+    def add(self, line: si.Line) -> int:
+        points = line.points
+        if not isinstance(points, si.PointArrays):
+            points = si.PointArrays.from_points(points)
+        typecodes = ""
+        for name, column in zip(_POINT_COLUMNS, self.columns):
+            values = getattr(points, name)
+            typecodes += values.typecode
+            column += values.tobytes()
+
+        self.colors.append(line.color)
+        self.tools.append(line.tool)
+        self.thickness_scales.append(line.thickness_scale)
+        self.starting_lengths.append(line.starting_length)
+        self.move_ids.append(_id(line.move_id))
+        self.point_offsets.append(self.point_offsets[-1] + len(points))
+        self.typecodes.append(typecodes)
+        return len(self.tools) - 1
+
+    def dump(self):
+        return (
+            self.colors.tobytes(),
+            self.tools.tobytes(),
+            self.thickness_scales.tobytes(),
+            self.starting_lengths.tobytes(),
+            self.move_ids,
+            self.point_offsets.tobytes(),
+            "".join(self.typecodes),
+            [bytes(column) for column in self.columns],
+        )
+
+
+def _load_lines(data) -> list[si.Line]:
+    colors, tools, thickness_scales, starting_lengths, move_ids, point_offsets, typecodes, columns = data
+    colors = array("B", colors)
+    tools = array("B", tools)
+    thickness_scales = array("d", thickness_scales)
+    starting_lengths = array("d", starting_lengths)
+    point_offsets = array("q", point_offsets)
+    columns = [memoryview(column) for column in columns]
+    # Position of the next line's points in each column
+    positions = [0] * len(columns)
+
+    lines = []
+    for i in range(len(tools)):
+        count = point_offsets[i + 1] - point_offsets[i]
+        arrays = []
+        for j, column in enumerate(columns):
+            values = array(typecodes[i * 6 + j])
+            end = positions[j] + count * values.itemsize
+            values.frombytes(column[positions[j]:end])
+            positions[j] = end
+            arrays.append(values)
+        lines.append(si.Line(
+            si.PenColor(colors[i]),
+            si.Pen(tools[i]),
+            si.PointArrays(*arrays),
+            thickness_scales[i],
+            starting_lengths[i],
+            _crdt_id(move_ids[i]),
+        ))
+    return lines
+
+
+def tree_to_snapshot(tree: SceneTree) -> bytes:
+    """Serialize `tree` to a snapshot, see `tree_from_snapshot`.
+
+    Raises `ValueError` if the tree holds items a snapshot can't represent.
+    """
+    lines = _LineTable()
+    groups = []
+    for node_id, group in tree._node_ids.items():
+        children = []
+        for item in group.children.sequence_items():
+            value = item.value
+            if value is None:
+                kind, payload = _EMPTY, None
+            elif isinstance(value, si.Group):
+                kind, payload = _GROUP, _id(value.node_id)
+            elif isinstance(value, si.Line):
+                kind, payload = _LINE, lines.add(value)
+            elif isinstance(value, si.GlyphRange):
+                kind, payload = _GLYPH, (
+                    value.start, value.length, value.text, int(value.color),
+                    [(r.x, r.y, r.w, r.h) for r in value.rectangles],
+                )
+            else:
+                raise ValueError("Can't snapshot %s" % type(value).__name__)
+            children.append((
+                _id(item.item_id), _id(item.left_id), _id(item.right_id), item.deleted_length, kind, payload
+            ))
+        groups.append((
+            _id(node_id),
+            _lww(group.label),
+            _lww(group.visible),
+            _lww(group.anchor_id, _id),
+            _lww(group.anchor_type),
+            _lww(group.anchor_threshold),
+            _lww(group.anchor_origin_x),
+            children,
+        ))
+
+    text = None
+    if tree.root_text is not None:
+        root_text = tree.root_text
+        text = (
+            [
+                (_id(item.item_id), _id(item.left_id), _id(item.right_id), item.deleted_length, item.value)
+                for item in root_text.items.sequence_items()
+            ],
+            [(_id(char_id), _lww(style, int)) for char_id, style in root_text.styles.items()],
+            root_text.pos_x,
+            root_text.pos_y,
+            root_text.width,
+        )
+
+    return SNAPSHOT_MAGIC + marshal.dumps((PARSER_VERSION, groups, lines.dump(), text))
+
+
+def tree_from_snapshot(data: bytes) -> SceneTree:
+    """Rebuild the tree saved with `tree_to_snapshot`.
+
+    Raises `ValueError` if `data` is not a snapshot of this parser version and
+    Python version, or is corrupt.
+    """
+    if not data.startswith(SNAPSHOT_MAGIC):
+        raise ValueError("Not a tree snapshot of this Python version")
+    try:
+        version, groups, line_data, text = marshal.loads(memoryview(data)[len(SNAPSHOT_MAGIC):])
+    except (EOFError, TypeError, ValueError) as e:
+        raise ValueError("Corrupt tree snapshot") from e
+    if version != PARSER_VERSION:
+        raise ValueError("Tree snapshot from parser version %s" % version)
+    try:
+        return _tree_from_snapshot_data(groups, line_data, text)
+    except Exception as e:
+        raise ValueError("Corrupt tree snapshot") from e
+
+
+def _tree_from_snapshot_data(groups, line_data, text) -> SceneTree:
+    lines = _load_lines(line_data)
+    tree = SceneTree()
+    nodes = tree._node_ids
+    for group_data in groups:
+        node_id = CrdtId(*group_data[0])
+        if node_id not in nodes:
+            nodes[node_id] = si.Group(node_id)
+
+    for node_id, label, visible, anchor_id, anchor_type, anchor_threshold, anchor_origin_x, children in groups:
+        group = nodes[CrdtId(*node_id)]
+        group.label = _from_lww(label)
+        group.visible = _from_lww(visible)
+        group.anchor_id = _from_lww(anchor_id, _crdt_id)
+        group.anchor_type = _from_lww(anchor_type)
+        group.anchor_threshold = _from_lww(anchor_threshold)
+        group.anchor_origin_x = _from_lww(anchor_origin_x)
+        items = []
+        for item_id, left_id, right_id, deleted_length, kind, payload in children:
+            if kind == _GROUP:
+                value = nodes[CrdtId(*payload)]
+            elif kind == _LINE:
+                value = lines[payload]
+            elif kind == _GLYPH:
+                start, length, glyph_text, color, rectangles = payload
+                value = si.GlyphRange(
+                    start, length, glyph_text, si.PenColor(color), [si.Rectangle(*r) for r in rectangles]
+                )
+            else:
+                value = None
+            items.append(CrdtSequenceItem(
+                CrdtId(*item_id), CrdtId(*left_id), CrdtId(*right_id), deleted_length, value
+            ))
+        group.children = CrdtSequence(items)
+
+    if text is not None:
+        items, styles, pos_x, pos_y, width = text
+        tree.root_text = si.Text(
+            CrdtSequence([
+                CrdtSequenceItem(CrdtId(*item_id), CrdtId(*left_id), CrdtId(*right_id), deleted_length, value)
+                for item_id, left_id, right_id, deleted_length, value in items
+            ]),
+            {CrdtId(*char_id): _from_lww(style, si.ParagraphStyle) for char_id, style in styles},
+            pos_x,
+            pos_y,
+            width,
+        )
+    return tree
+
+
+## Cache
+
+
+# Rough memory used by parts of a tree, measured with tracemalloc on CPython
+# 3.11: a sequence item with its ids, a line with its empty point arrays, a
+# `Point` object and a group with its values
+_ITEM_BYTES = 350
+_LINE_BYTES = 850
+_POINT_BYTES = 200
+_GROUP_BYTES = 1000
+
+
+def estimate_tree_bytes(tree: SceneTree) -> int:
+    """Estimate the memory used by `tree`, without walking its points."""
+    size = 0
+    for group in tree._node_ids.values():
+        size += _GROUP_BYTES
+        for item in group.children.sequence_items():
+            size += _ITEM_BYTES
+            value = item.value
+            if isinstance(value, si.Line):
+                points = value.points
+                size += _LINE_BYTES
+                if isinstance(points, si.PointArrays):
+                    size += sum(
+                        len(column) * column.itemsize
+                        for column in (points.x, points.y, points.speed, points.direction, points.width,
+                                       points.pressure)
+                    )
+                else:
+                    size += len(points) * _POINT_BYTES
+            elif isinstance(value, si.GlyphRange):
+                size += len(value.text)
+    if tree.root_text is not None:
+        for item in tree.root_text.items.sequence_items():
+            size += _ITEM_BYTES
+            if isinstance(item.value, str):
+                size += len(item.value)
+        size += len(tree.root_text.styles) * _ITEM_BYTES
+    return size
+
+
+@dataclass
+class ParseCacheStats:
+    """Counters of a `ParseCache`."""
+
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    disk_evictions: int = 0
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    def __add__(self, other: ParseCacheStats) -> ParseCacheStats:
+        return ParseCacheStats(*(
+            getattr(self, field.name) + getattr(other, field.name) for field in fields(self)
+        ))
+
+    def __sub__(self, other: ParseCacheStats) -> ParseCacheStats:
+        return ParseCacheStats(*(
+            getattr(self, field.name) - getattr(other, field.name) for field in fields(self)
+        ))
+
+
+class ParseCache:
+    """LRU cache of parsed pages, in memory and optionally on disk.
+
+    The memory cache keeps trees up to an estimated total size of
+    `max_memory_bytes`, see `estimate_tree_bytes`. Snapshots are saved in `directory`, which is trimmed to
+    `max_disk_bytes` by removing the least recently used ones.
+
+    Cached trees are shared between callers and must not be modified.
+
+    """
+
+    def __init__(
+            self,
+            directory: tp.Optional[str] = None,
+            max_memory_bytes: int = 64 * 1024 * 1024,
+            max_disk_bytes: int = 512 * 1024 * 1024,
+    ):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.stats = ParseCacheStats()
+        self._memory: OrderedDict[str, tuple[SceneTree, int]] = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes: tp.Optional[int] = None
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def blob_hash(data: bytes) -> str:
+        """Hash identifying `data`, for callers which don't know its hash."""
+        return hashlib.sha256(data).hexdigest()
+
+    def snapshot_path(self, blob_hash: str) -> str:
+        return os.path.join(self.directory, f"{blob_hash}.{PARSER_VERSION}.{SNAPSHOT_FORMAT}{SNAPSHOT_EXTENSION}")
+
+    def read_tree(self, data: tp.Union[bytes, tp.Callable[[], bytes]], blob_hash: str = None) -> SceneTree:
+        """Return the tree of page `data`, parsing it only if it isn't cached.
+
+        :param data: page data, or a function returning it so it is only loaded
+            when needed.
+        :param blob_hash: hash of the page data, computed if not given.
+        """
+        if blob_hash is None:
+            if callable(data):
+                data = data()
+            blob_hash = self.blob_hash(data)
+
+        with self._lock:
+            if blob_hash in self._memory:
+                self._memory.move_to_end(blob_hash)
+                self.stats.memory_hits += 1
+                return self._memory[blob_hash][0]
+
+        snapshot = self._load_snapshot(blob_hash)
+        if snapshot is not None:
+            try:
+                tree = tree_from_snapshot(snapshot)
+            except ValueError:
+                pass
+            else:
+                with self._lock:
+                    self.stats.disk_hits += 1
+                self._remember(blob_hash, tree, estimate_tree_bytes(tree))
+                return tree
+
+        if callable(data):
+            data = data()
+        tree = read_tree(data, {"compact_points": True})
+        with self._lock:
+            self.stats.misses += 1
+        try:
+            snapshot = tree_to_snapshot(tree)
+        except ValueError:
+            return tree
+        self._remember(blob_hash, tree, estimate_tree_bytes(tree))
+        self._save_snapshot(blob_hash, snapshot)
+        return tree
+
+    def _remember(self, blob_hash: str, tree: SceneTree, size: int):
+        with self._lock:
+            if blob_hash in self._memory:
+                return
+            self._memory[blob_hash] = (tree, size)
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+                _, (_, evicted_size) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_size
+                self.stats.evictions += 1
+
+    def _load_snapshot(self, blob_hash: str) -> tp.Optional[bytes]:
+        if self.directory is None:
+            return None
+        path = self.snapshot_path(blob_hash)
+        try:
+            with open(path, "rb") as f:
+                snapshot = f.read()
+            # Mark as recently used
+            os.utime(path)
+        except OSError:
+            return None
+        return snapshot
+
+    def _save_snapshot(self, blob_hash: str, snapshot: bytes):
+        if self.directory is None:
+            return
+        path = self.snapshot_path(blob_hash)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp_path, "wb") as f:
+                f.write(snapshot)
+            os.replace(temp_path, path)
+        except OSError:
+            return
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_bytes()
+            else:
+                self._disk_bytes += len(snapshot)
+            if self._disk_bytes > self.max_disk_bytes:
+                self._trim_disk()
+
+    def _snapshot_files(self) -> list[os.DirEntry]:
+        try:
+            return [
+                entry for entry in os.scandir(self.directory)
+                if entry.name.endswith(SNAPSHOT_EXTENSION) and entry.is_file()
+            ]
+        except OSError:
+            return []
+
+    def _scan_disk_bytes(self) -> int:
+        return sum(entry.stat().st_size for entry in self._snapshot_files())
+
+    def _trim_disk(self):
+        entries = sorted(self._snapshot_files(), key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            total -= size
+            self.stats.disk_evictions += 1
+        self._disk_bytes = total
+
+    def clear_memory(self):
+        """Drop all trees kept in memory."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+
+_caches: dict[tp.Optional[str], ParseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_parse_cache(directory: tp.Optional[str] = None, max_memory_bytes: tp.Optional[int] = None) -> ParseCache:
+    """Return the cache of this process saving snapshots in `directory`.
+
+    Each process has its own caches. `max_memory_bytes` sets the memory budget
+    of the cache when it is first made, see `ParseCache`.
+    """
+    with _caches_lock:
+        if directory not in _caches:
+            if max_memory_bytes is None:
+                _caches[directory] = ParseCache(directory)
+            else:
+                _caches[directory] = ParseCache(directory, max_memory_bytes)
+        return _caches[directory]
@@ -12,6 +12,7 @@ import typing as tp
 from .exceptions import BlockOverflowError
 from ..tagged_block_common import (
     DataStream,
+    BytesDataStream,
     TagType,
     CrdtId,
     UnexpectedBlockError,
@@ -47,10 +48,22 @@ class SubBlockInfo(BlockInfo):
 
 
 class TaggedBlockReader:
-    """Read blocks and values from a remarkable v6 file stream."""
-
-    def __init__(self, data: tp.BinaryIO):
-        rm_data = DataStream(data)
+    """Read blocks and values from a remarkable v6 file stream.
+
+    `data` can be a file object or an in-memory buffer (`bytes`, `bytearray`
+    or `memoryview`). Buffers are read in place with a `BytesDataStream`.
+
+    """
+
+    def __init__(self, data: tp.Union[tp.BinaryIO, bytes, bytearray, memoryview],
+                 options: tp.Optional[dict] = None):
+        if options is None:
+            options = {}
+        self.options = options
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            rm_data = BytesDataStream(data)
+        else:
+            rm_data = DataStream(data)
         self.data = rm_data
         self.current_block: tp.Optional[MainBlockInfo] = None
 
@@ -103,47 +116,50 @@ class TaggedBlockReader:
 
     ## Read simple values -- optional variants
 
-    def _read_optional(self, func, index, default):
+    def _read_optional(self, func, index, tag_type, default):
+        # Peek first, so that absent values don't cost an exception
+        if self.data.peek_tag() != (index, tag_type):
+            return default
         try:
             return func(index)
-        except (UnexpectedBlockError, EOFError):
+        except EOFError:
             return default
 
     def read_id_optional(
             self, index: int, default: tp.Optional[CrdtId] = None
     ) -> tp.Optional[CrdtId]:
         """Read a tagged CRDT ID, return `default` if not present."""
-        return self._read_optional(self.read_id, index, default)
+        return self._read_optional(self.read_id, index, TagType.ID, default)
 
     def read_bool_optional(
             self, index: int, default: tp.Optional[bool] = None
     ) -> tp.Optional[bool]:
         """Read a tagged bool, return `default` if not present."""
-        return self._read_optional(self.read_bool, index, default)
+        return self._read_optional(self.read_bool, index, TagType.Byte1, default)
 
     def read_byte_optional(
             self, index: int, default: tp.Optional[int] = None
     ) -> tp.Optional[int]:
         """Read a tagged byte as an unsigned integer, return `default` if not present."""
-        return self._read_optional(self.read_byte, index, default)
+        return self._read_optional(self.read_byte, index, TagType.Byte1, default)
 
     def read_int_optional(
             self, index: int, default: tp.Optional[int] = None
     ) -> tp.Optional[int]:
         """Read a tagged 4-byte unsigned integer, return `default` if not present."""
-        return self._read_optional(self.read_int, index, default)
+        return self._read_optional(self.read_int, index, TagType.Byte4, default)
 
     def read_float_optional(
             self, index: int, default: tp.Optional[float] = None
     ) -> tp.Optional[float]:
         """Read a tagged 4-byte float, return `default` if not present."""
-        return self._read_optional(self.read_float, index, default)
+        return self._read_optional(self.read_float, index, TagType.Byte4, default)
 
     def read_double_optional(
             self, index: int, default: tp.Optional[float] = None
     ) -> tp.Optional[float]:
         """Read a tagged 8-byte double, return `default` if not present."""
-        return self._read_optional(self.read_double, index, default)
+        return self._read_optional(self.read_double, index, TagType.Byte8, default)
 
     ## Blocks
 
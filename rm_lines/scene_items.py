@@ -1,5 +1,7 @@
 """Data structures for the contents of a scene."""
 
+from array import array
+from collections.abc import Sequence
 from dataclasses import dataclass, field
 import enum
 import typing as tp
@@ -115,11 +117,79 @@ class Point:
     pressure: int
 
 
+class PointArrays(Sequence):
+    """Compact struct-of-arrays storage for the points of a `Line`.
+
+    Each attribute of `Point` is kept in its own `array.array`, which takes a
+    fraction of the memory of a list of `Point` objects and can be consumed
+    column-wise by renderers.
+
+    Indexing and iterating yield `Point` objects built on the fly, so existing
+    code reading `line.points` keeps working. These are copies: changing them
+    does not change the arrays.
+
+    """
+
+    __slots__ = ("x", "y", "speed", "direction", "width", "pressure")
+
+    def __init__(self, x: array, y: array, speed: array, direction: array, width: array, pressure: array):
+        if not len(x) == len(y) == len(speed) == len(direction) == len(width) == len(pressure):
+            raise ValueError("Point arrays must all have the same length")
+        self.x = x
+        self.y = y
+        self.speed = speed
+        self.direction = direction
+        self.width = width
+        self.pressure = pressure
+
+    @classmethod
+    def from_points(cls, points: tp.Iterable[Point]) -> "PointArrays":
+        """Build arrays from `Point` objects, without losing precision."""
+        points = list(points)
+        return cls(*(
+            _column([getattr(point, name) for point in points])
+            for name in cls.__slots__
+        ))
+
+    def _columns(self):
+        return self.x, self.y, self.speed, self.direction, self.width, self.pressure
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PointArrays(*(column[index] for column in self._columns()))
+        return Point(*(column[index] for column in self._columns()))
+
+    def __iter__(self) -> tp.Iterator[Point]:
+        for values in zip(*self._columns()):
+            yield Point(*values)
+
+    def __eq__(self, other):
+        if isinstance(other, PointArrays):
+            return self._columns() == other._columns()
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return "PointArrays(%d points)" % len(self)
+
+
+def _column(values: list) -> array:
+    """Store integers as integers so they can still be written as such."""
+    try:
+        return array("q", values)
+    except TypeError:
+        return array("d", values)
+
+
 @dataclass
 class Line(SceneItem):
     color: PenColor
     tool: Pen
-    points: list[Point]
+    points: tp.Union[list[Point], PointArrays]
     thickness_scale: float
     starting_length: float
     move_id: tp.Optional[CrdtId] = None
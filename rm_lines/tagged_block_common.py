@@ -29,15 +29,105 @@ class UnexpectedBlockError(Exception):
     """Unexpected tag or index in block stream."""
 
 
-@dataclass(eq=True, order=True, frozen=True)
+# Bits of a packed `CrdtId` holding part2, which is written as a varuint of
+# up to 64 bits
+_PART2_BITS = 64
+_PART2_MASK = (1 << _PART2_BITS) - 1
+
+
 class CrdtId:
-    """An identifier or timestamp."""
-    part1: int
-    part2: int
+    """An identifier or timestamp.
+
+    Both parts are packed into a single int (`part1 << 64 | part2`), so ids
+    are small, and hashing and comparing them is a single int operation. Ids
+    compare in the same order as `(part1, part2)` tuples. Ids are immutable.
+
+    """
+
+    __slots__ = ("_value",)
+
+    _interned: tp.ClassVar[dict[int, CrdtId]] = {}
+
+    def __init__(self, part1: int, part2: int):
+        if part1 < 0 or not 0 <= part2 <= _PART2_MASK:
+            raise ValueError("Invalid CrdtId(%s, %s)" % (part1, part2))
+        self._value = part1 << _PART2_BITS | part2
+
+    @classmethod
+    def intern(cls, part1: int, part2: int) -> CrdtId:
+        """Return the shared instance of a special id, or a new id.
+
+        Only the fixed set of special ids of author 0 (end marker, root,
+        first layer and the top/bottom anchors) are shared, so reading a page
+        never grows the table.
+        """
+        if part1 == 0:
+            crdt_id = cls._interned.get(part2)
+            if crdt_id is not None:
+                return crdt_id
+        return cls(part1, part2)
+
+    @property
+    def part1(self) -> int:
+        return self._value >> _PART2_BITS
+
+    @property
+    def part2(self) -> int:
+        return self._value & _PART2_MASK
 
     def __repr__(self) -> str:
         return f"CrdtId({self.part1}, {self.part2})"
 
+    def __hash__(self) -> int:
+        return hash(self._value)
+
+    def __eq__(self, other):
+        if isinstance(other, CrdtId):
+            return self._value == other._value
+        return NotImplemented
+
+    def __ne__(self, other):
+        if isinstance(other, CrdtId):
+            return self._value != other._value
+        return NotImplemented
+
+    def __lt__(self, other):
+        if isinstance(other, CrdtId):
+            return self._value < other._value
+        return NotImplemented
+
+    def __le__(self, other):
+        if isinstance(other, CrdtId):
+            return self._value <= other._value
+        return NotImplemented
+
+    def __gt__(self, other):
+        if isinstance(other, CrdtId):
+            return self._value > other._value
+        return NotImplemented
+
+    def __ge__(self, other):
+        if isinstance(other, CrdtId):
+            return self._value >= other._value
+        return NotImplemented
+
+    def __reduce__(self):
+        return CrdtId, (self.part1, self.part2)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+# Ids of author 0 which appear in many blocks: the end marker, root and
+# first layer nodes and their labels, and the top/bottom text anchors
+CrdtId._interned.update(
+    (part2, CrdtId(0, part2))
+    for part2 in (*range(16), 0xFFFFFFFFFFFE, 0xFFFFFFFFFFFF)
+)
+
 
 class DataStream:
     """Read basic values from a remarkable v6 file stream."""
@@ -48,6 +138,9 @@ class DataStream:
     def tell(self) -> int:
         return self.data.tell()
 
+    def seek(self, pos: int):
+        self.data.seek(pos)
+
     def read_header(self) -> None:
         """Read the file header.
 
@@ -66,6 +159,22 @@ class DataStream:
         """
         self.write_bytes(HEADER_V6)
 
+    def peek_tag(self) -> tp.Optional[tuple[int, int]]:
+        """Return the next (index, tag type) without advancing the stream.
+
+        Never raises: returns None if there is no complete tag left. The tag
+        type is returned as a plain int if it is not a known `TagType`.
+
+        """
+        pos = self.tell()
+        try:
+            x = self.read_varuint()
+        except EOFError:
+            return None
+        finally:
+            self.seek(pos)  # Go back
+        return x >> 4, x & 0xF
+
     def check_tag(self, expected_index: int, expected_type: TagType) -> bool:
         """Check that INDEX and TAG_TYPE are next.
 
@@ -73,14 +182,7 @@ class DataStream:
         advance the stream.
 
         """
-        pos = self.data.tell()
-        try:
-            index, tag_type = self._read_tag_values()
-            return (index == expected_index) and (tag_type == expected_type)
-        except (ValueError, EOFError):
-            return False
-        finally:
-            self.data.seek(pos)  # Go back
+        return self.peek_tag() == (expected_index, expected_type)
 
     def read_tag(
             self, expected_index: int, expected_type: TagType
@@ -91,25 +193,25 @@ class DataStream:
         rewind the stream.
 
         """
-        pos = self.data.tell()
+        pos = self.tell()
         index, tag_type = self._read_tag_values()
 
         if index != expected_index:
-            self.data.seek(pos)  # Go back
+            self.seek(pos)  # Go back
             raise UnexpectedBlockError(
                 "Expected index %d, got %d, at position %d"
-                % (expected_index, index, self.data.tell())
+                % (expected_index, index, self.tell())
             )
 
         if tag_type != expected_type:
-            self.data.seek(pos)  # Go back
+            self.seek(pos)  # Go back
             raise UnexpectedBlockError(
                 "Expected tag type %s (0x%X), got 0x%X at position %d"
                 % (
                     expected_type.name,
                     expected_type.value,
                     tag_type,
-                    self.data.tell(),
+                    self.tell(),
                 )
             )
 
@@ -130,7 +232,7 @@ class DataStream:
             tag_type = TagType(tag_type)
         except ValueError as e:
             raise ValueError(
-                "Bad tag type 0x%X at position %d" % (tag_type, self.data.tell())
+                "Bad tag type 0x%X at position %d" % (tag_type, self.tell())
             )
 
         return index, tag_type
@@ -147,6 +249,10 @@ class DataStream:
             raise EOFError()
         return result
 
+    def read_view(self, n: int) -> tp.Union[bytes, memoryview]:
+        """Read `n` bytes for decoding, without copying where possible."""
+        return self.read_bytes(n)
+
     def write_bytes(self, b: bytes):
         """Write bytes to underlying stream."""
         self.data.write(b)
@@ -201,8 +307,8 @@ class DataStream:
         # TODO: should be var unit?
         part1 = self.read_uint8()
         part2 = self.read_varuint()
-        # result = (part1 << 48) | part2
-        return CrdtId(part1, part2)
+        # Special ids, such as layers and anchors, appear in many blocks
+        return CrdtId.intern(part1, part2)
 
     def write_bool(self, value: bool):
         """Write a bool to the data stream."""
@@ -254,6 +360,171 @@ class DataStream:
         # result = (part1 << 48) | part2
 
 
+_STRUCTS: dict[str, struct.Struct] = {}
+
+
+def _struct(pattern: str) -> struct.Struct:
+    """Return a precompiled little-endian `struct.Struct` for `pattern`."""
+    try:
+        return _STRUCTS[pattern]
+    except KeyError:
+        compiled = _STRUCTS[pattern] = struct.Struct("<" + pattern)
+        return compiled
+
+
+class BytesDataStream(DataStream):
+    """Read basic values directly from an in-memory buffer.
+
+    Values are decoded in place at an integer cursor instead of going through
+    a file object, and `read_view` slices the buffer without copying it.
+
+    This stream is read-only.
+
+    """
+
+    def __init__(self, data: tp.Union[bytes, bytearray, memoryview]):
+        if not isinstance(data, bytes):
+            data = memoryview(data).cast("B")
+        self.data = data
+        self._view = memoryview(data)
+        self._pos = 0
+        self._end = len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, pos: int):
+        self._pos = pos
+
+    def read_bytes(self, n: int) -> bytes:
+        "Read `n` bytes, raising `EOFError` if there are not enough."
+        return bytes(self.read_view(n))
+
+    def read_view(self, n: int) -> memoryview:
+        "Read `n` bytes as a view on the buffer, raising `EOFError` if there are not enough."
+        pos = self._pos
+        end = pos + n
+        if n < 0 or end > self._end:
+            raise EOFError()
+        self._pos = end
+        return self._view[pos:end]
+
+    def _read_struct(self, pattern: str):
+        compiled = _struct(pattern)
+        pos = self._pos
+        end = pos + compiled.size
+        if end > self._end:
+            raise EOFError()
+        self._pos = end
+        return compiled.unpack_from(self.data, pos)[0]
+
+    def read_uint8(self) -> int:
+        """Read a uint8 from the data stream."""
+        pos = self._pos
+        if pos >= self._end:
+            raise EOFError()
+        self._pos = pos + 1
+        return self.data[pos]
+
+    def read_varuint(self) -> int:
+        """Read a varuint from the data stream."""
+        data = self.data
+        pos = self._pos
+        end = self._end
+        shift = 0
+        result = 0
+        while True:
+            if pos >= end:
+                raise EOFError()
+            i = data[pos]
+            pos += 1
+            result |= (i & 0x7F) << shift
+            shift += 7
+            if not (i & 0x80):
+                break
+        self._pos = pos
+        return result
+
+    def peek_tag(self) -> tp.Optional[tuple[int, int]]:
+        """Return the next (index, tag type) without advancing the stream."""
+        data = self.data
+        pos = self._pos
+        end = self._end
+        shift = 0
+        x = 0
+        while True:
+            if pos >= end:
+                return None
+            i = data[pos]
+            pos += 1
+            x |= (i & 0x7F) << shift
+            shift += 7
+            if not (i & 0x80):
+                break
+        return x >> 4, x & 0xF
+
+
+_UINT32 = struct.Struct("<I")
+
+
+class ByteArrayDataStream(DataStream):
+    """Write basic values by appending to an in-memory buffer.
+
+    Space for a length can be reserved with `reserve_uint32` and filled in with
+    `patch_uint32` once the data it covers has been written.
+
+    This stream is write-only.
+
+    """
+
+    def __init__(self, data: tp.Optional[bytearray] = None):
+        if data is None:
+            data = bytearray()
+        self.data = data
+
+    def tell(self) -> int:
+        return len(self.data)
+
+    def write_bytes(self, b: bytes):
+        """Write bytes to the buffer."""
+        self.data += b
+
+    def _write_struct(self, pattern: str, value):
+        self.data += _struct(pattern).pack(value)
+
+    def write_uint8(self, value: int):
+        """Write a uint8 to the data stream."""
+        self.data.append(value)
+
+    def write_bool(self, value: bool):
+        """Write a bool to the data stream."""
+        self.data.append(1 if value else 0)
+
+    def write_uint32(self, value: int):
+        """Write a uint32 to the data stream."""
+        self.data += _UINT32.pack(value)
+
+    def write_varuint(self, value: int):
+        """Write a varuint to the data stream."""
+        if value < 0:
+            raise ValueError("value is negative")
+        data = self.data
+        while value > 0x7F:
+            data.append(value & 0x7F | 0x80)
+            value >>= 7
+        data.append(value)
+
+    def reserve_uint32(self) -> int:
+        """Write a placeholder uint32, returning its position for `patch_uint32`."""
+        pos = len(self.data)
+        self.data += b"\0\0\0\0"
+        return pos
+
+    def patch_uint32(self, pos: int, value: int):
+        """Overwrite the uint32 at `pos`."""
+        _UINT32.pack_into(self.data, pos, value)
+
+
 _T = tp.TypeVar("_T")
 
 
@@ -4,7 +4,9 @@
 
 from __future__ import annotations
 
-from collections.abc import Iterable
+from bisect import bisect_right
+from collections import defaultdict
+from collections.abc import Iterable, Sequence
 from dataclasses import dataclass, field
 import typing as tp
 
@@ -61,6 +63,284 @@ def expand_text_items(
         yield from expand_text_item(item)
 
 
+TextSpan = tuple[CrdtId, tp.Union[str, int], int]
+
+
+def ordered_text_spans(
+        items: Iterable[CrdtSequenceItem[str | int]],
+) -> tp.Optional[list[TextSpan]]:
+    """Order TextItems as spans of consecutive characters.
+
+    Each span is a `(first char id, value, length)` tuple. The value is a
+    string, an integer formatting code (length 1), or "" for `length` deleted
+    characters.
+
+    This gives the same order as expanding the items with `expand_text_items`
+    and sorting the characters in a `CrdtSequence`, but only splits up items
+    where other items are inserted into them. If the items are in a shape where
+    that is not possible (overlapping character ids, cycles, or insertions that
+    interleave character by character), None is returned.
+
+    """
+
+    runs = []
+    for item in items:
+        if item.deleted_length > 0:
+            if item.value != "":
+                return None
+            runs.append((item, "", item.deleted_length))
+        elif isinstance(item.value, int):
+            runs.append((item, item.value, 1))
+        elif item.value:
+            runs.append((item, item.value, len(item.value)))
+
+    # Index the character ids of each run, so references to characters in the
+    # middle of a run can be found
+    starts_by_part1 = defaultdict(list)
+    for index, (item, _, length) in enumerate(runs):
+        starts_by_part1[item.item_id.part1].append((item.item_id.part2, length, index))
+    for starts in starts_by_part1.values():
+        starts.sort()
+        for (start, length, _), (next_start, _, _) in zip(starts, starts[1:]):
+            if start + length > next_start:
+                return None
+    start_keys = {part1: [start for start, _, _ in starts] for part1, starts in starts_by_part1.items()}
+
+    def locate(char_id: CrdtId) -> tp.Optional[tuple[int, int]]:
+        starts = starts_by_part1.get(char_id.part1)
+        if not starts:
+            return None
+        i = bisect_right(start_keys[char_id.part1], char_id.part2) - 1
+        if i < 0:
+            return None
+        start, length, index = starts[i]
+        offset = char_id.part2 - start
+        return (index, offset) if offset < length else None
+
+    if locate(si.END_MARKER) is not None:
+        return None
+
+    # Cut runs where other items refer to characters inside them
+    cuts = [{0, length} for _, _, length in runs]
+    for item, _, _ in runs:
+        if (location := locate(item.left_id)) is not None:
+            index, offset = location
+            cuts[index].add(offset + 1)
+        if (location := locate(item.right_id)) is not None:
+            index, offset = location
+            cuts[index].add(offset)
+
+    segments = []
+    segment_starting_at = {}
+    segment_ending_at = {}
+    for index, run_cuts in enumerate(cuts):
+        run_cuts = sorted(run_cuts)
+        for offset, end in zip(run_cuts, run_cuts[1:]):
+            segment_starting_at[index, offset] = len(segments)
+            segment_ending_at[index, end - 1] = len(segments)
+            segments.append((index, offset, end - offset))
+
+    def left_node(char_id: CrdtId):
+        if char_id == si.END_MARKER:
+            return "__start"
+        location = locate(char_id)
+        return char_id if location is None else segment_ending_at[location]
+
+    def right_node(char_id: CrdtId):
+        if char_id == si.END_MARKER:
+            return "__end"
+        location = locate(char_id)
+        return char_id if location is None else segment_starting_at[location]
+
+    # Same dependencies as between the expanded characters, where each
+    # segment stands for a chain of characters
+    deps = defaultdict(set)
+    for segment, (index, offset, length) in enumerate(segments):
+        item, _, run_length = runs[index]
+        deps[segment].add(left_node(item.left_id) if offset == 0 else segment - 1)
+        if offset + length == run_length:
+            deps[right_node(item.right_id)].add(segment)
+
+    dependents = defaultdict(list)
+    in_degree = {}
+    for node, node_deps in deps.items():
+        in_degree[node] = len(node_deps)
+        for dep in node_deps:
+            dependents[dep].append(node)
+    for dep in dependents:
+        in_degree.setdefault(dep, 0)
+
+    # Longest path gives the toposort wave of each segment's first character
+    level = {}
+    pending = [node for node, count in in_degree.items() if count == 0]
+    for node in pending:
+        level[node] = 0
+    released = 0
+    while pending:
+        node = pending.pop()
+        released += 1
+        end_level = level[node] + (segments[node][2] if isinstance(node, int) else 1)
+        for dependent in dependents.get(node, ()):
+            if level.get(dependent, 0) < end_level:
+                level[dependent] = end_level
+            in_degree[dependent] -= 1
+            if in_degree[dependent] == 0:
+                pending.append(dependent)
+    if released != len(in_degree):
+        return None
+
+    # Characters are only kept in whole segments if no two share a wave
+    order = sorted(range(len(segments)), key=level.__getitem__)
+    last_level = -1
+    for segment in order:
+        if level[segment] <= last_level:
+            return None
+        last_level = level[segment] + segments[segment][2] - 1
+
+    # The toposort gives up if the end marker is on its own, but not last
+    if "__end" in level:
+        end_level = level["__end"]
+        max_level = max(last_level, max(n for node, n in level.items() if not isinstance(node, int)))
+        shares_level = any(
+            n == end_level for node, n in level.items() if node != "__end" and not isinstance(node, int)
+        ) or any(
+            level[segment] <= end_level < level[segment] + segments[segment][2] for segment in order
+        )
+        if not shares_level and max_level > end_level:
+            return None
+
+    spans = []
+    for segment in order:
+        index, offset, length = segments[segment]
+        item, value, _ = runs[index]
+        char_id = CrdtId(item.item_id.part1, item.item_id.part2 + offset)
+        if isinstance(value, str) and value:
+            value = value[offset:offset + length]
+        spans.append((char_id, value, length))
+    return spans
+
+
+def expanded_text_spans(items: Iterable[CrdtSequenceItem[str | int]]) -> list[TextSpan]:
+    """Order TextItems as single-character spans, see `ordered_text_spans`."""
+    char_items = CrdtSequence(expand_text_items(items))
+    return [(char_id, value, 1) for char_id, value in char_items.items()]
+
+
+class CharIds(Sequence):
+    """Character ids stored as runs of consecutive ids.
+
+    Behaves like a list of `CrdtId`s, without keeping one per character: it
+    can be appended to, extended, indexed (in O(log runs)), sliced and added to
+    lists, and compares equal to a list of the same ids. Slices and sums are
+    `CharIds` too. Setting an item is supported but rebuilds the runs.
+    """
+
+    __slots__ = ("_runs", "_starts", "_length")
+
+    def __init__(self, ids: Iterable[CrdtId] = ()):
+        self._runs: list[list[int]] = []  # [part1, first part2, length]
+        self._starts: list[int] = []  # Index of the first id of each run
+        self._length = 0
+        self.extend(ids)
+
+    def add_run(self, start: CrdtId, length: int):
+        """Add `length` consecutive ids starting at `start`."""
+        if length <= 0:
+            return
+        if self._runs:
+            last = self._runs[-1]
+            if last[0] == start.part1 and last[1] + last[2] == start.part2:
+                last[2] += length
+                self._length += length
+                return
+        self._runs.append([start.part1, start.part2, length])
+        self._starts.append(self._length)
+        self._length += length
+
+    def append(self, char_id: CrdtId):
+        self.add_run(char_id, 1)
+
+    def extend(self, ids: Iterable[CrdtId]):
+        if isinstance(ids, CharIds):
+            for part1, part2, length in list(ids._runs):
+                self.add_run(CrdtId(part1, part2), length)
+            return
+        for char_id in ids:
+            self.add_run(char_id, 1)
+
+    def __iadd__(self, ids: Iterable[CrdtId]):
+        self.extend(ids)
+        return self
+
+    def __add__(self, ids: Iterable[CrdtId]) -> CharIds:
+        if not isinstance(ids, (CharIds, list, tuple)):
+            return NotImplemented
+        result = CharIds(self)
+        result.extend(ids)
+        return result
+
+    def __radd__(self, ids: Iterable[CrdtId]) -> CharIds:
+        if not isinstance(ids, (list, tuple)):
+            return NotImplemented
+        result = CharIds(ids)
+        result.extend(self)
+        return result
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> tp.Iterator[CrdtId]:
+        for part1, part2, length in self._runs:
+            for offset in range(length):
+                yield CrdtId(part1, part2 + offset)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._slice(index)
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("CharIds index out of range")
+        run = bisect_right(self._starts, index) - 1
+        part1, part2, _ = self._runs[run]
+        return CrdtId(part1, part2 + index - self._starts[run])
+
+    def _slice(self, index: slice) -> CharIds:
+        start, stop, step = index.indices(self._length)
+        if step != 1:
+            return CharIds(list(self)[index])
+        result = CharIds()
+        if start >= stop:
+            return result
+        run = bisect_right(self._starts, start) - 1
+        while run < len(self._runs) and self._starts[run] < stop:
+            part1, part2, length = self._runs[run]
+            run_start = self._starts[run]
+            first = max(start, run_start)
+            last = min(stop, run_start + length)
+            result.add_run(CrdtId(part1, part2 + first - run_start), last - first)
+            run += 1
+        return result
+
+    def __setitem__(self, index, value):
+        ids = list(self)
+        ids[index] = value
+        self._runs = []
+        self._starts = []
+        self._length = 0
+        self.extend(ids)
+
+    def __eq__(self, other):
+        if isinstance(other, CharIds):
+            return self._runs == other._runs
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return "CharIds(%r)" % list(self)
+
+
 @dataclass
 class CrdtStr:
     """String with CrdtIds for chars and optional properties.
@@ -72,7 +352,8 @@ class CrdtStr:
     """
 
     s: str = ""
-    i: list[CrdtId] = field(default_factory=list)
+    # Ids of the chars of `s`; list-like, see `CharIds`
+    i: CharIds = field(default_factory=CharIds)
     properties: dict = field(default_factory=dict)
 
     def __str__(self):
@@ -104,13 +385,11 @@ class TextDocument:
         This uses the inline formatting introduced in v3.3.2.
         """
 
-        char_formats = {k: lww.value for k, lww in text.styles.items()}
-        if si.END_MARKER not in char_formats:
-            char_formats[si.END_MARKER] = si.ParagraphStyle.PLAIN
+        items = text.items.sequence_items()
+        spans = ordered_text_spans(items)
+        if spans is None:
+            spans = expanded_text_spans(items)
 
-        # Expand from strings to characters
-        char_items = CrdtSequence(expand_text_items(text.items.sequence_items()))
-        keys = list(char_items)
         properties = {"font-weight": "normal", "font-style": "normal"}
 
         def handle_formatting_code(code):
@@ -124,38 +403,61 @@ class TextDocument:
                 properties["font-style"] = "normal"
             return properties
 
-        def parse_paragraph_contents():
-            if keys and char_items[keys[0]] == "\n":
-                start_id = keys.pop(0)
-            else:
-                start_id = si.END_MARKER
-            contents = []
-            while keys:
-                char = char_items[keys[0]]
-                if isinstance(char, int):
-                    handle_formatting_code(char)
-                elif char == "\n":
-                    # End of paragraph
-                    break
-                else:
-                    assert len(char) <= 1
-                    # Start a new string if text properties have changed
-                    if not contents or contents[-1].properties != properties:
-                        contents += [CrdtStr(properties=properties.copy())]
-                    contents[-1].s += char
-                    contents[-1].i += [keys[0]]
-                keys.pop(0)
-
-            return start_id, contents
-
         paragraphs = []
-        while keys:
-            start_id, contents = parse_paragraph_contents()
+        contents = None
+        # Text of each CrdtStr, joined at the end
+        pieces: list[tuple[CrdtStr, list[str]]] = []
+
+        def start_paragraph(start_id):
+            nonlocal contents
+            contents = []
             if start_id in text.styles:
-                p = Paragraph(contents, start_id, text.styles[start_id])
+                paragraphs.append(Paragraph(contents, start_id, text.styles[start_id]))
             else:
-                p = Paragraph(contents, start_id)
-            paragraphs += [p]
+                paragraphs.append(Paragraph(contents, start_id))
+
+        def add_chars(s, start_id, length):
+            # Start a new string if text properties have changed
+            if not contents or contents[-1].properties != properties:
+                contents.append(CrdtStr(properties=properties.copy()))
+                pieces.append((contents[-1], []))
+            pieces[-1][1].append(s)
+            contents[-1].i.add_run(start_id, length)
+
+        for start_id, value, length in spans:
+            if isinstance(value, int):
+                if contents is None:
+                    start_paragraph(si.END_MARKER)
+                handle_formatting_code(value)
+                continue
+            if value == "":
+                # Deleted characters keep their ids
+                if contents is None:
+                    start_paragraph(si.END_MARKER)
+                add_chars(value, start_id, length)
+                continue
+
+            # Each newline starts a new paragraph
+            offset = 0
+            while offset < length:
+                newline = value.find("\n", offset)
+                end = length if newline < 0 else newline
+                if contents is None:
+                    if end == offset:
+                        # Leading newline starts the first paragraph
+                        start_paragraph(CrdtId(start_id.part1, start_id.part2 + offset))
+                        offset += 1
+                        continue
+                    start_paragraph(si.END_MARKER)
+                if end > offset:
+                    add_chars(value[offset:end], CrdtId(start_id.part1, start_id.part2 + offset), end - offset)
+                if newline < 0:
+                    break
+                start_paragraph(CrdtId(start_id.part1, start_id.part2 + newline))
+                offset = newline + 1
+
+        for crdt_str, strings in pieces:
+            crdt_str.s = "".join(strings)
 
         doc = cls(paragraphs)
         return doc
@@ -0,0 +1,253 @@
+"""Check the structure of reMarkable v6 files without reading their contents.
+
+`validate_blocks` walks the file header, the block headers and the tags of
+each block, checking that lengths and tag types are consistent. Scene items are
+never built, so this is much cheaper than `read_blocks` and points at the exact
+offset of each problem.
+
+Run as a script to check every page in a directory, e.g. the sync cache::
+
+    python -m rm_lines.validate path/to/sync
+
+"""
+
+from __future__ import annotations
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import os
+import struct
+import sys
+import typing as tp
+
+from .blocks import AuthorIdsBlock, Block
+from .tagged_block_common import HEADER_V6, TagType
+
+# Start of the header of all versions of the lines format
+LINES_HEADER_PREFIX = b"reMarkable .lines file, version="
+
+_UINT32 = struct.Struct("<I")
+_BLOCK_HEADER = struct.Struct("<IBBBB")
+
+# Size of the data following a tag of each type, other than Length4 and ID
+_TAG_DATA_SIZES = {
+    TagType.Byte1: 1,
+    TagType.Byte4: 4,
+    TagType.Byte8: 8,
+}
+
+# Blocks starting with an untagged varuint before their tags
+_VARUINT_PREFIX_BLOCK_TYPES = {AuthorIdsBlock.BLOCK_TYPE}
+
+
+@dataclass
+class ValidationIssue:
+    """Problem found at `offset` in the file."""
+
+    offset: int
+    message: str
+    block_type: tp.Optional[int] = None
+
+    def __str__(self):
+        if self.block_type is None:
+            return f"@{self.offset}: {self.message}"
+        return f"@{self.offset} (block type {self.block_type:#04x}): {self.message}"
+
+
+@dataclass
+class ValidationReport:
+    """Result of `validate_blocks`."""
+
+    size: int
+    block_count: int = 0
+    issues: list[ValidationIssue] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.issues
+
+
+def _read_varuint(data: memoryview, pos: int, end: int) -> tuple[int, int]:
+    """Read a varuint at `pos`, returning it and the position after it.
+
+    Raises `EOFError` if it runs past `end`.
+    """
+    result = 0
+    shift = 0
+    while True:
+        if pos >= end:
+            raise EOFError
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def _validate_tags(data: memoryview, pos: int, end: int, block_type: int, issues: list[ValidationIssue]):
+    """Check the tags between `pos` and `end`.
+
+    Subblocks are only checked to fit in their parent, as their contents are
+    not always tagged.
+    """
+    while pos < end:
+        tag_offset = pos
+        try:
+            tag, pos = _read_varuint(data, pos, end)
+        except EOFError:
+            issues.append(ValidationIssue(tag_offset, "Tag runs past the end of the block", block_type))
+            return
+        tag_type = tag & 0xF
+        if tag_type == TagType.ID:
+            # uint8 then varuint
+            try:
+                _, pos = _read_varuint(data, pos + 1, end)
+            except EOFError:
+                issues.append(ValidationIssue(tag_offset, "ID runs past the end of the block", block_type))
+                return
+        elif tag_type == TagType.Length4:
+            if pos + 4 > end:
+                issues.append(ValidationIssue(tag_offset, "Subblock length runs past the end of the block",
+                                              block_type))
+                return
+            length, = _UINT32.unpack_from(data, pos)
+            pos += 4 + length
+            if pos > end:
+                issues.append(ValidationIssue(
+                    tag_offset, f"Subblock {tag >> 4} of {length} bytes runs past the end of the block by "
+                                f"{pos - end} bytes", block_type
+                ))
+                return
+        elif tag_type in _TAG_DATA_SIZES:
+            pos += _TAG_DATA_SIZES[tag_type]
+            if pos > end:
+                issues.append(ValidationIssue(tag_offset, "Tag data runs past the end of the block", block_type))
+                return
+        else:
+            issues.append(ValidationIssue(tag_offset, f"Bad tag type {tag_type:#x} (index {tag >> 4})", block_type))
+            return
+
+
+def validate_blocks(data: tp.Union[bytes, memoryview]) -> ValidationReport:
+    """Check the header, block framing and tags of reMarkable v6 file `data`.
+
+    Checking stops at the first block whose framing is broken, as the following
+    blocks can't be located.
+    """
+    data = memoryview(data)
+    size = len(data)
+    report = ValidationReport(size)
+    issues = report.issues
+
+    header = bytes(data[:len(HEADER_V6)])
+    if header != HEADER_V6:
+        if header.startswith(LINES_HEADER_PREFIX):
+            issues.append(ValidationIssue(0, "Unsupported version: %r" % header.rstrip().decode(errors="replace")))
+        else:
+            issues.append(ValidationIssue(0, "Wrong header: %r" % header))
+        return report
+
+    pos = len(HEADER_V6)
+    while pos < size:
+        if pos + _BLOCK_HEADER.size > size:
+            issues.append(ValidationIssue(pos, f"Truncated block header ({size - pos} bytes)"))
+            break
+        length, unknown, min_version, current_version, block_type = _BLOCK_HEADER.unpack_from(data, pos)
+        start = pos + _BLOCK_HEADER.size
+        end = start + length
+        report.block_count += 1
+        if end > size:
+            issues.append(ValidationIssue(
+                pos, f"Block of {length} bytes runs past the end of the data by {end - size} bytes", block_type
+            ))
+            break
+        if unknown != 0:
+            issues.append(ValidationIssue(pos, f"Unexpected value {unknown} in block header", block_type))
+        if min_version > current_version:
+            issues.append(ValidationIssue(
+                pos, f"Min version {min_version} above current version {current_version}", block_type
+            ))
+        if Block.lookup(block_type) is None:
+            issues.append(ValidationIssue(pos, "Unknown block type", block_type))
+        else:
+            tags_start = start
+            if block_type in _VARUINT_PREFIX_BLOCK_TYPES:
+                try:
+                    _, tags_start = _read_varuint(data, start, end)
+                except EOFError:
+                    issues.append(ValidationIssue(start, "Count runs past the end of the block", block_type))
+                    tags_start = end
+            _validate_tags(data, tags_start, end, block_type, issues)
+        pos = end
+    return report
+
+
+def is_lines_file(data: bytes) -> bool:
+    """Check if `data` looks like a lines file of any version."""
+    return data.startswith(LINES_HEADER_PREFIX)
+
+
+def validate_file(path: str) -> tp.Optional[ValidationReport]:
+    """Validate the file at `path`, returning None if it isn't a lines file."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not is_lines_file(data):
+        return None
+    return validate_blocks(data)
+
+
+def _validate_path(path: str) -> tuple[str, tp.Optional[ValidationReport], tp.Optional[str]]:
+    try:
+        return path, validate_file(path), None
+    except OSError as e:
+        return path, None, str(e)
+
+
+def main(argv: tp.Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m rm_lines.validate",
+        description="Check the structure of all reMarkable lines files in a directory.",
+    )
+    parser.add_argument("directory", help="directory of page blobs, searched recursively")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes")
+    parser.add_argument("-v", "--verbose", action="store_true", help="list every issue, not only the first")
+    args = parser.parse_args(argv)
+
+    paths = [
+        os.path.join(root, name)
+        for root, _, names in os.walk(args.directory)
+        for name in names
+    ]
+
+    checked = skipped = bad = blocks = 0
+    unreadable = []
+    with ProcessPoolExecutor(args.jobs) as executor:
+        for path, report, error in executor.map(_validate_path, paths, chunksize=16):
+            if error is not None:
+                unreadable.append((path, error))
+                continue
+            if report is None:
+                skipped += 1
+                continue
+            checked += 1
+            blocks += report.block_count
+            if report.ok:
+                continue
+            bad += 1
+            print(f"{path}: {len(report.issues)} issue(s)")
+            for issue in report.issues if args.verbose else report.issues[:1]:
+                print(f"    {issue}")
+
+    for path, error in unreadable:
+        print(f"{path}: could not read: {error}")
+    print(
+        f"Checked {checked} lines files ({blocks} blocks), skipped {skipped} other files: "
+        f"{checked - bad} ok, {bad} with issues, {len(unreadable)} unreadable"
+    )
+    return 1 if bad or unreadable else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,29 +9,45 @@ from __future__ import annotations
 
 from collections.abc import Iterator
 from contextlib import contextmanager
-from io import BytesIO
+import struct
 import typing as tp
 
 from ..tagged_block_common import (
     TagType,
-    DataStream,
+    ByteArrayDataStream,
     CrdtId,
     LwwValue,
     UnexpectedBlockError,
 )
 
 
+# unknown, min_version, current_version, block_type
+_BLOCK_INFO = struct.Struct("<BBBB")
+
+
 class TaggedBlockWriter:
-    """Write blocks and values to a remarkable v6 file stream."""
+    """Write blocks and values to a remarkable v6 file stream.
+
+    Values are appended to an in-memory buffer, which is written to the file
+    stream after the header and after each block.
+
+    """
 
     def __init__(self, data: tp.BinaryIO, options: tp.Optional[dict] = None):
         if options is None:
             options = {}
         self.options = options
-        rm_data = DataStream(data)
-        self.data = rm_data
+        self._output = data
+        self.data = ByteArrayDataStream()
         self._in_block: bool = False
 
+    def flush(self) -> None:
+        """Write out everything buffered so far."""
+        buffer = self.data.data
+        if buffer:
+            self._output.write(buffer)
+            buffer.clear()
+
     def write_header(self) -> None:
         """Write the file header.
 
@@ -39,6 +55,7 @@ class TaggedBlockWriter:
 
         """
         self.data.write_header()
+        self.flush()
 
     ## Write simple values
 
@@ -81,52 +98,41 @@ class TaggedBlockWriter:
     ) -> Iterator[None]:
         """Write a top-level block header.
 
-        Within this block, other writes are accumulated, so that the
-        whole block can be written out with its length at the end.
+        The block length is reserved in the header and filled in once the
+        with-block has exited.
 
         """
         if self._in_block:
             raise UnexpectedBlockError("Already in a block")
 
-        previous_data = self.data
-        block_buf = BytesIO()
-        block_data = DataStream(block_buf)
+        length_pos = self.data.reserve_uint32()
+        self.data.write_bytes(_BLOCK_INFO.pack(0, min_version, current_version, block_type))
+        start = self.data.tell()
         try:
-            self.data = block_data
             self._in_block = True
             yield
+        except BaseException:
+            # Drop the incomplete block
+            del self.data.data[length_pos:]
+            raise
         finally:
-            self.data = previous_data
+            self._in_block = False
 
-        assert self._in_block
-        self._in_block = False
-
-        self.data.write_uint32(len(block_buf.getbuffer()))
-        self.data.write_uint8(0)
-        self.data.write_uint8(min_version)
-        self.data.write_uint8(current_version)
-        self.data.write_uint8(block_type)
-        self.data.write_bytes(block_buf.getbuffer())
+        self.data.patch_uint32(length_pos, self.data.tell() - start)
+        self.flush()
 
     @contextmanager
     def write_subblock(self, index: int) -> Iterator[None]:
-        """Write a subblock tag and length once the with-block has exited.
+        """Write a subblock tag and length.
 
-        Within this block, other writes are accumulated, so that the
-        whole block can be written out with its length at the end.
+        The length is reserved after the tag and filled in once the with-block
+        has exited.
         """
-        previous_data = self.data
-        subblock_buf = BytesIO()
-        subblock_data = DataStream(subblock_buf)
-        try:
-            self.data = subblock_data
-            yield
-        finally:
-            self.data = previous_data
-
         self.data.write_tag(index, TagType.Length4)
-        self.data.write_uint32(len(subblock_buf.getbuffer()))
-        self.data.write_bytes(subblock_buf.getbuffer())
+        length_pos = self.data.reserve_uint32()
+        start = self.data.tell()
+        yield
+        self.data.patch_uint32(length_pos, self.data.tell() - start)
 
     ## Higher level constructs
 